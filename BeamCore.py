@@ -0,0 +1,1121 @@
+# Vyir
+# Vyirtech.com
+
+# Qt-free core of the beam profiler: camera access, beam analysis and saving.
+# Used by the PyQt GUI (BeamProfiler.py) and by headless operation (BeamHeadless.py)
+
+# required imports
+import numpy as np
+import cv2
+import time
+import math
+import threading
+import collections
+import copy
+import os
+import tracemalloc
+from scipy.optimize import curve_fit
+from BeamStorage import ProfilePlotter, SaveSession, frame_stats, write_data
+
+# resolutions offered by the GUI and accepted by the control API
+RESOLUTIONS = [
+    (640, 480),
+    (1280, 720),
+    (1920, 1080),
+    (2560, 1440),
+    (4056, 3040),
+]
+
+# Rainbow colormap of the inverted grayscale image as a lookup table, so the beam image
+# is colormapped without building an inverted copy of every frame
+INVERTED_RAINBOW = cv2.applyColorMap(np.arange(255, -1, -1, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_RAINBOW)
+
+# memory page size, used to convert /proc/self/statm to bytes
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Gaussian function that takes x values, amplitude (a),
+# center position (x0), and standard deviation (sigma) as input
+
+
+def gaussian(x, a, x0, sigma):
+    return a * np.exp(-((x - x0) ** 2) / (2 * sigma**2))
+
+
+# Fit a Gaussian curve to the given `data` and return the optimized
+# parameters: amplitude (a), center position (x0), and standard deviation (sigma)
+
+
+def fit_gaussian(data):
+    x = np.arange(len(data))
+    mean = np.sum(x * data) / np.sum(data)
+    sigma = np.sqrt(np.sum(data * (x - mean) ** 2) / np.sum(data))
+    popt, _ = curve_fit(
+        gaussian, x, data, p0=[np.max(data), mean, sigma], maxfev=100000
+    )
+    return popt
+
+
+# Calculate and return the full width at half maximum (FWHM) for
+# a Gaussian curve given its standard deviation (sigma)
+
+
+def full_width_half_maximum(sigma):
+    return sigma * np.sqrt(8 * np.log(2))
+
+
+# Scale factor used to downsample images to fit on the GUI screen
+def display_scale(W, H):
+    if W == 640 and H == 480:
+        return 1
+    elif W == 1280 and H == 720:
+        return 2
+    elif W == 1920 and H == 1080:
+        return 3
+    elif W == 2560 and H == 1440:
+        return 4
+    elif W == 4056 and H == 3040:
+        return 6
+    return 1
+
+
+# Preallocated per-frame buffers. Every per-frame operation writes into a named buffer
+# (dst=/out=) instead of allocating a new full-size array each frame; a buffer is only
+# reallocated when the frame size changes. With cap_mb set, growing the pool beyond the
+# cap raises MemoryError (e.g. for a resolution too large for the memory budget)
+class FramePool:
+    def __init__(self, cap_mb=None, reuse=True):
+        self.cap_mb = cap_mb  # memory budget for all buffers in MB (None: unlimited)
+        self.reuse = reuse  # False allocates a fresh buffer on every request (for comparison)
+        self.buffers = {}
+        self.allocations = 0  # buffers allocated since creation
+
+    # Buffer `name` with the given shape and dtype, allocated only if it does not exist yet
+    def buffer(self, name, shape, dtype=np.uint8):
+        shape = tuple(shape)
+        buf = self.buffers.get(name)
+        if buf is not None and buf.shape == shape and buf.dtype == dtype and self.reuse:
+            return buf
+        # release the old buffer before allocating its replacement
+        self.buffers.pop(name, None)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.cap_mb is not None and self.nbytes + size > self.cap_mb * 1e6:
+            raise MemoryError(
+                "Frame buffer '{}' {} needs {:.1f} MB, over the {:.0f} MB budget ({:.1f} MB in use)".format(
+                    name, "x".join(str(n) for n in shape), size / 1e6, self.cap_mb, self.nbytes / 1e6
+                )
+            )
+        buf = np.empty(shape, dtype)
+        self.buffers[name] = buf
+        self.allocations += 1
+        return buf
+
+    @property
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self.buffers.values())
+
+    def clear(self):
+        self.buffers.clear()
+
+    def status(self):
+        return {
+            "cap_mb": self.cap_mb,
+            "mb": self.nbytes / 1e6,
+            "buffers": len(self.buffers),
+            "allocations": self.allocations,
+        }
+
+
+# Resident set size of this process in bytes (current, and peak since the process started)
+def current_rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+def peak_rss():
+    import resource
+
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Per-frame memory accounting: RSS, peak RSS, frame buffer allocations and (with
+# trace=True, which slows every allocation down) the Python/NumPy memory allocated
+# on top of the buffers while a frame is processed
+class MemoryTracker:
+    def __init__(self, pool=None, trace=False):
+        self.pool = pool
+        self.trace = trace
+        self.frames = 0
+        self.rss = None
+        self.peak_rss = None
+        self.frame_allocations = 0  # pool allocations during the latest frame
+        self.frame_peak_bytes = 0  # traced bytes allocated on top of the buffers during the latest frame
+        self.max_frame_peak_bytes = 0
+        self._allocations = 0
+        self._traced = 0
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start_frame(self):
+        if self.pool is not None:
+            self._allocations = self.pool.allocations
+        if self.trace:
+            tracemalloc.reset_peak()
+            self._traced = tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self):
+        self.frames += 1
+        if self.pool is not None:
+            self.frame_allocations = self.pool.allocations - self._allocations
+        if self.trace:
+            self.frame_peak_bytes = tracemalloc.get_traced_memory()[1] - self._traced
+            self.max_frame_peak_bytes = max(self.max_frame_peak_bytes, self.frame_peak_bytes)
+        self.rss = current_rss()
+        # the kernel updates the peak lazily, it can briefly trail the current RSS
+        self.peak_rss = max(peak_rss(), self.rss or 0)
+
+    def status(self):
+        return {
+            "frames": self.frames,
+            "rss_mb": self.rss / 1e6 if self.rss is not None else None,
+            "peak_rss_mb": self.peak_rss / 1e6 if self.peak_rss is not None else None,
+            "pool": self.pool.status() if self.pool is not None else None,
+            "frame_allocations": self.frame_allocations,
+            "frame_peak_mb": self.frame_peak_bytes / 1e6 if self.trace else None,
+            "max_frame_peak_mb": self.max_frame_peak_bytes / 1e6 if self.trace else None,
+        }
+
+
+# Camera settings shared by the GUI and the headless control API
+class CameraSettings:
+    # names which can be changed through update()
+    FIELDS = (
+        "resolution",
+        "shutter_speed",
+        "iso",
+        "awb_mode",
+        "awb_gains",
+        "brightness",
+        "meter_mode",
+        "exposure_mode",
+        "exposure_compensation",
+        "saturation",
+    )
+
+    def __init__(self, **values):
+        self.resolution = (640, 480)
+        self.shutter_speed = 1000
+        self.iso = 1
+        self.awb_mode = "off"
+        self.awb_gains = (3.1, 3.1)
+        self.brightness = 50
+        self.meter_mode = "average"
+        self.exposure_mode = "off"
+        self.exposure_compensation = 0
+        self.saturation = 0
+        self.update(**values)
+
+    # Set fields from keyword arguments, converting them to the types PiCamera expects
+    def update(self, **values):
+        for name, value in values.items():
+            if name not in self.FIELDS:
+                raise ValueError("Unknown camera setting: " + name)
+            if name == "resolution":
+                if isinstance(value, str):
+                    value = value.split("x")
+                value = (int(value[0]), int(value[1]))
+                if value not in RESOLUTIONS:
+                    raise ValueError(
+                        "Unsupported resolution {}x{}, choose from ".format(*value)
+                        + ", ".join("{}x{}".format(*resolution) for resolution in RESOLUTIONS)
+                    )
+            elif name == "awb_gains":
+                value = (float(value[0]), float(value[1]))
+            elif name in ("awb_mode", "meter_mode", "exposure_mode"):
+                value = str(value)
+            else:
+                value = int(value)
+            setattr(self, name, value)
+        return self
+
+    def copy(self):
+        return CameraSettings(**self.as_dict())
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+# Frames captured into two alternating pool buffers: a returned frame stays valid
+# until two more frames have been captured
+CAPTURE_BUFFERS = 2
+
+
+# Raspberry Pi camera source. Frames are captured straight into preallocated numpy
+# buffers instead of a new PiRGBArray array per frame
+class PiCameraSource:
+    def __init__(self, settings):
+        self.settings = settings
+        self.camera = None
+        self.pool = FramePool()  # capture buffers, see BeamProcessor.attach()
+        self.captured = 0
+
+    # initialize camera settings
+    def open(self):
+        # picamera is only available on the Pi, import it when a camera is opened
+        from picamera import PiCamera
+
+        settings = self.settings
+        W, H = settings.resolution
+
+        # Initialize the PiCamera and set the resolution
+        camera = PiCamera()
+        camera.resolution = (W, H)
+
+        # Allow camera to warm up
+        time.sleep(0.1)
+
+        # Set camera settings
+        camera.awb_mode = settings.awb_mode
+        camera.awb_gains = settings.awb_gains
+        camera.brightness = settings.brightness
+        camera.meter_mode = settings.meter_mode
+        camera.exposure_mode = settings.exposure_mode
+        camera.exposure_compensation = settings.exposure_compensation
+        camera.shutter_speed = settings.shutter_speed
+        camera.vflip = True
+        camera.hflip = False
+        camera.iso = settings.iso
+        camera.saturation = settings.saturation
+
+        # Optional settings for zoom and framerate
+        ZOOM_BOOL = False
+        if ZOOM_BOOL:
+            crop_factor = 0.4
+            roi_start_x = (1 - crop_factor) / 2
+            roi_start_y = (1 - crop_factor) / 2
+            camera.zoom = (roi_start_x, roi_start_y, crop_factor, crop_factor)
+
+        # Print camera settings if desired
+        CAMERA_SETTINGS = True
+        if CAMERA_SETTINGS:
+            print("AWB is " + str(camera.awb_mode))
+            print("AWB gain is " + str(camera.awb_gains))
+            print("Brightness is " + str(camera.brightness))
+            print("Aperture is " + str(camera.exposure_compensation))
+            print("Shutter speed is " + str(camera.shutter_speed))
+            print("Camera exposure speed is " + str(camera.exposure_speed))
+            print("Iso is " + str(camera.iso))
+            print("Camera digital gain is " + str(camera.digital_gain))
+            print("Camera analog gain is " + str(camera.analog_gain))
+            print("Camera v/h flip is " + str(camera.vflip) + ", " + str(camera.hflip))
+            print("Camera contrast is " + str(camera.contrast))
+            print("Camera color saturation is " + str(camera.saturation))
+            print("Camera meter mode is " + str(camera.meter_mode))
+            # print("framerate "+str(camera.framerate))
+            if ZOOM_BOOL:
+                print("Camera crop factor is " + str(crop_factor))
+            else:
+                print("Camera crop is disabled")
+
+        # Assign camera to the instance
+        self.camera = camera
+
+    # Apply new settings to the open camera. Everything except the resolution is
+    # changed live; a resolution change only resizes the capture buffers, the camera
+    # itself stays open. Returns True if the resolution changed
+    def reconfigure(self, settings):
+        camera = self.camera
+        resized = settings.resolution != self.settings.resolution
+        if resized:
+            camera.resolution = settings.resolution
+
+        # CameraSettings fields share their names with the PiCamera attributes
+        for name in CameraSettings.FIELDS:
+            value = getattr(settings, name)
+            if name != "resolution" and value != getattr(self.settings, name):
+                setattr(camera, name, value)
+        self.settings = settings
+        return resized
+
+    # Capture an image from the camera and return it as a BGR array. The camera writes
+    # rows padded to multiples of 32 x 16 pixels; the returned frame is a view without the padding
+    def capture(self):
+        W, H = self.settings.resolution
+        shape = ((H + 15) // 16 * 16, (W + 31) // 32 * 32, 3)
+        frame = self.pool.buffer("capture" + str(self.captured % CAPTURE_BUFFERS), shape)
+        self.camera.capture(frame, format="bgr")
+        self.captured += 1
+        return frame[:H, :W]
+
+    # Values actually used by the camera, read back for display
+    def readback(self):
+        camera = self.camera
+        return {
+            "shutter_speed": camera.shutter_speed,
+            "framerate": camera.framerate,
+            "brightness": camera.brightness,
+            "exposure_compensation": camera.exposure_compensation,
+            "iso": camera.iso,
+            "saturation": camera.saturation,
+        }
+
+    def close(self):
+        if self.camera:
+            self.camera.close()
+            self.camera = None
+
+
+# USB/V4L2 camera (or video file) read through cv2.VideoCapture. Shutter speed is
+# passed in the V4L2 unit of 100 μs; the other settings map to the closest OpenCV property
+class OpenCVCameraSource:
+    def __init__(self, settings, device=0):
+        self.settings = settings
+        self.device = device  # device index or video file/stream path
+        self.capture_device = None
+        self.pool = FramePool()  # capture buffers, see BeamProcessor.attach()
+        self.captured = 0
+        self.frame_shape = None  # shape of the frames the driver actually delivers
+
+    def open(self):
+        self.capture_device = cv2.VideoCapture(self.device)
+        if not self.capture_device.isOpened():
+            raise RuntimeError("Could not open camera " + str(self.device))
+        self.apply(self.settings, None)
+
+    # Set all properties which differ from `previous` (all of them if previous is None)
+    def apply(self, settings, previous):
+        device = self.capture_device
+        if previous is None or settings.resolution != previous.resolution:
+            device.set(cv2.CAP_PROP_FRAME_WIDTH, settings.resolution[0])
+            device.set(cv2.CAP_PROP_FRAME_HEIGHT, settings.resolution[1])
+        if previous is None or settings.exposure_mode != previous.exposure_mode:
+            # V4L2: 1 = manual exposure, 3 = aperture priority (auto)
+            device.set(cv2.CAP_PROP_AUTO_EXPOSURE, 3 if settings.exposure_mode == "auto" else 1)
+        if previous is None or settings.shutter_speed != previous.shutter_speed:
+            device.set(cv2.CAP_PROP_EXPOSURE, settings.shutter_speed / 100.0)
+        if previous is None or settings.brightness != previous.brightness:
+            device.set(cv2.CAP_PROP_BRIGHTNESS, settings.brightness)
+        if previous is None or settings.saturation != previous.saturation:
+            device.set(cv2.CAP_PROP_SATURATION, settings.saturation)
+        if previous is None or settings.iso != previous.iso:
+            device.set(cv2.CAP_PROP_GAIN, settings.iso)
+
+    def reconfigure(self, settings):
+        resized = settings.resolution != self.settings.resolution
+        if resized:
+            self.frame_shape = None
+        self.apply(settings, self.settings)
+        self.settings = settings
+        return resized
+
+    # Read the next frame into a capture buffer (the driver may deliver another size
+    # than requested, so the buffer follows the size of the frame actually read)
+    def capture(self):
+        W, H = self.settings.resolution
+        shape = self.frame_shape or (H, W, 3)
+        frame = self.pool.buffer("capture" + str(self.captured % CAPTURE_BUFFERS), shape)
+        ok, image = self.capture_device.read(frame)
+        if not ok:
+            raise RuntimeError("Could not read from camera " + str(self.device))
+        self.captured += 1
+        if image is not frame:
+            # OpenCV allocated a frame of another size; read into buffers of that size from now on
+            self.frame_shape = image.shape
+        return image
+
+    def readback(self):
+        device = self.capture_device
+        return {
+            "shutter_speed": int(device.get(cv2.CAP_PROP_EXPOSURE) * 100),
+            "framerate": device.get(cv2.CAP_PROP_FPS),
+            "brightness": device.get(cv2.CAP_PROP_BRIGHTNESS),
+            "exposure_compensation": self.settings.exposure_compensation,
+            "iso": device.get(cv2.CAP_PROP_GAIN),
+            "saturation": device.get(cv2.CAP_PROP_SATURATION),
+        }
+
+    def close(self):
+        if self.capture_device is not None:
+            self.capture_device.release()
+            self.capture_device = None
+
+
+# Simulated camera producing a Gaussian beam whose brightness follows the shutter
+# speed and ISO like a real sensor (clipped at 255). Used without camera hardware,
+# e.g. to test how fast the auto-exposure controller converges
+class SimulatedCameraSource:
+    def __init__(self, settings, center=None, waist=None, rate=0.2, noise=1.0, seed=0):
+        self.settings = settings
+        self.center = center  # beam center (x, y) in pixels, image center by default
+        self.waist = waist  # 1/e² beam radius in pixels, a sixth of the image height by default
+        self.rate = rate  # counts per μs of exposure at the beam peak (ISO 100)
+        self.noise = noise  # standard deviation of the additive sensor noise
+        self.rng = np.random.default_rng(seed)
+        self.profile = None
+        self.pool = FramePool()  # capture buffers, see BeamProcessor.attach()
+        self.work = FramePool()  # the simulator's own working buffers, outside the capture pool's cap
+        self.captured = 0
+
+    def open(self):
+        W, H = self.settings.resolution
+        cx, cy = self.center if self.center is not None else (W / 2, H / 2)
+        w = self.waist if self.waist is not None else H / 6
+        x = np.arange(W, dtype=np.float32) - cx
+        y = np.arange(H, dtype=np.float32) - cy
+        self.profile = np.outer(np.exp(-2 * y**2 / w**2), np.exp(-2 * x**2 / w**2))
+
+    def reconfigure(self, settings):
+        resized = settings.resolution != self.settings.resolution
+        self.settings = settings
+        if resized:
+            self.open()
+        return resized
+
+    def capture(self):
+        pool = self.work
+        shape = self.profile.shape
+        gain = max(self.settings.iso, 100) / 100.0
+        signal = pool.buffer("sim_signal", shape, np.float32)
+        np.multiply(self.profile, self.rate * self.settings.shutter_speed * gain, out=signal)
+        if self.noise:
+            noise = pool.buffer("sim_noise", shape, np.float32)
+            self.rng.standard_normal(dtype=np.float32, out=noise)
+            noise *= self.noise
+            signal += noise
+        np.clip(signal, 0, 255, out=signal)
+        image = pool.buffer("sim_gray", shape)
+        np.copyto(image, signal, casting="unsafe")
+        frame = self.pool.buffer("capture" + str(self.captured % CAPTURE_BUFFERS), shape + (3,))
+        self.captured += 1
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=frame)
+
+    def readback(self):
+        settings = self.settings
+        return {
+            "shutter_speed": settings.shutter_speed,
+            "framerate": 0,
+            "brightness": settings.brightness,
+            "exposure_compensation": settings.exposure_compensation,
+            "iso": settings.iso,
+            "saturation": settings.saturation,
+        }
+
+    def close(self):
+        self.profile = None
+
+
+# Create a camera source from a short description:
+#   "pi"                  Raspberry Pi camera
+#   "usb:<n>" / "cv:<path>"  cv2.VideoCapture device index or video file
+#   "sim[:<seed>]"        simulated beam
+def make_source(spec, settings):
+    kind, _, arg = spec.partition(":")
+    if kind == "pi":
+        return PiCameraSource(settings)
+    elif kind in ("usb", "cv"):
+        return OpenCVCameraSource(settings, int(arg) if arg.isdigit() else (arg or 0))
+    elif kind == "sim":
+        return SimulatedCameraSource(settings, seed=int(arg) if arg else 0)
+    raise ValueError("Unknown camera source: " + spec)
+
+
+# Hands new camera settings from the GUI/control API to the capture loop, which
+# applies them between two frames so the camera is never touched concurrently
+class SettingsMailbox:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = None
+        self.posted = 0  # number of settings posted
+        self.applied = 0  # number of the last settings applied by the capture loop
+        self.error = None  # why the camera rejected the last settings (None if they were applied)
+        # (milliseconds, resolution changed, error) of recent reconfigurations
+        self.history = collections.deque(maxlen=20)
+
+    # Queue settings for the capture loop (newer settings replace pending ones). Returns a ticket
+    def post(self, settings):
+        with self._cond:
+            self._pending = settings.copy()
+            self.posted += 1
+            return self.posted
+
+    # Called by the capture loop: pending settings (or None) and their ticket
+    def take(self):
+        with self._cond:
+            settings, self._pending = self._pending, None
+            return settings, self.posted
+
+    # Called by the capture loop once settings have been applied (or rejected with `error`)
+    def done(self, ticket, seconds, resized, error=None):
+        with self._cond:
+            self.applied = ticket
+            self.error = error
+            self.history.append((1000.0 * seconds, resized, error))
+            self._cond.notify_all()
+
+    # Wait until the settings with the given ticket have been applied
+    def wait(self, ticket, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.applied >= ticket, timeout)
+
+    # Apply pending settings to a camera source. Returns (milliseconds, resized) or None.
+    # If the camera rejects them it keeps the previous settings and the error is kept in
+    # `error`, so the capture loop carries on
+    def apply_pending(self, source):
+        settings, ticket = self.take()
+        if settings is None:
+            return None
+        previous = source.settings
+        resized, error = False, None
+        A = time.perf_counter()
+        try:
+            try:
+                resized = source.reconfigure(settings)
+            except Exception as e:
+                error = repr(e)
+                # the camera may have taken some of the new values already: reconfigure
+                # from the new settings back to the previous ones
+                source.settings = settings
+                source.reconfigure(previous)
+        finally:
+            seconds = time.perf_counter() - A
+            self.done(ticket, seconds, resized, error)
+        return 1000.0 * seconds, resized
+
+
+# Cheap per-frame change detection: mean absolute difference between a decimated grid
+# of the frame and of the last fully processed frame. Frames below the threshold can
+# reuse the previous results; a full refresh is forced every `refresh_every` frames
+class FrameChangeDetector:
+    def __init__(self, threshold=1.0, step=16, refresh_every=30):
+        self.threshold = threshold  # mean absolute difference (gray levels) counted as a change
+        self.step = step  # grid spacing in pixels
+        self.refresh_every = refresh_every  # process at least every Nth frame so results never go stale
+        self.reference = None  # decimated grid of the last processed frame
+        self.since_refresh = 0
+        self.last_difference = None
+        self.checked = 0  # frames checked
+        self.unchanged = 0  # frames reported as unchanged
+        self.skipped = collections.Counter()  # skipped pipeline stages
+
+    def reset(self):
+        self.reference = None
+        self.since_refresh = 0
+
+    # Decimated grid of a frame which is compared with the reference
+    def grid(self, image_live):
+        grid = image_live[:: self.step, :: self.step]
+        if grid.ndim == 3:
+            grid = grid[:, :, 1]  # green channel is enough to see the beam change
+        return grid
+
+    # Make a frame processed without checking it (e.g. for a save) the reference
+    def update(self, image_live):
+        self.reference = self.grid(image_live).copy()
+        self.since_refresh = 0
+
+    # True if the frame differs meaningfully from the last processed frame
+    def changed(self, image_live):
+        self.checked += 1
+        grid = self.grid(image_live)
+        if (
+            self.reference is None
+            or grid.shape != self.reference.shape
+            or self.since_refresh >= self.refresh_every
+        ):
+            self.last_difference = None
+        else:
+            self.last_difference = float(cv2.absdiff(grid, self.reference).mean())
+            if self.last_difference < self.threshold:
+                self.since_refresh += 1
+                self.unchanged += 1
+                return False
+        self.reference = grid.copy()
+        self.since_refresh = 0
+        return True
+
+    def status(self):
+        return {
+            "threshold": self.threshold,
+            "refresh_every": self.refresh_every,
+            "checked": self.checked,
+            "unchanged": self.unchanged,
+            "skipped": dict(self.skipped),
+            "last_difference": self.last_difference,
+        }
+
+
+# Accumulates wall time per pipeline stage so per-frame overhead can be measured
+class StageTimer:
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+
+    def add(self, stage, seconds):
+        self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    # Mean milliseconds per call of each stage
+    def report(self):
+        return {
+            stage: 1000.0 * self.totals[stage] / self.counts[stage]
+            for stage in self.totals
+        }
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+
+
+# Per-frame beam analysis: centroid and D4σ from image moments, Gaussian fits of
+# the x/y profiles through the centroid, colormapped beam image and data saving
+# All state is per instance, so several processors (one per camera) can run side by side
+class BeamProcessor:
+    def __init__(self):
+        self.SAVE_NOW = False  # flag to save all data once
+        self.LOGGING = False  # flag to continuously log data
+        # mask values for digital aperture
+        self.mask_x, self.mask_y, self.mask_r = 1296, 972, 880
+        # multiply a pixel width by 1.55 micron to get physical width #SENSOR DEPENDENT
+        self.pixel_um = 1.55
+        # threshold used for the dark pixel count in the saved statistics
+        self.dark_pixel_threshold = 0
+        self.frame_codec = "png"  # codec for saved frames, see BeamStorage.FRAME_CODECS
+        self.data_format = "npz"  # format for saved profiles and statistics, see BeamStorage.DATA_FORMATS
+        self.save_plots = False  # also render the x/y profile plots as PNG
+        self.image_live = None  # latest camera image (BGR)
+        self.image = None  # grayscale of the latest camera image
+        self.histogram = None  # 256-bin intensity histogram of the latest grayscale image
+        self.beam_image = None  # colormapped beam image, built on demand
+        self.W, self.H = 0, 0
+        self.save_prefix = ""  # prefix for saved file names
+        self.notes = ""  # additional information saved with the data
+        # latest per-frame metrics (centroid, D4σ, Gaussian fit parameters)
+        self.metrics = {}
+        self.profiles = None  # (x_prof, y_prof, fitted_x, fitted_y) of the latest fit
+        self.frame_count = 0
+        self.saved_to = None  # save directory written during the latest frame, if any
+        self.last_save = None  # directory, files, bytes and latency of the latest save
+        # session and sequence number under which the last analysed frame was saved, shared
+        # with snapshots so reused frames can point at it (None until it is saved)
+        self.processed = None
+        self.reserved = None  # (seq, timestamp_us) reserved by snapshot() for the save of a snapshot
+        self.plotter = None  # off-screen profile plotter, created on the first plot
+        self.save_root = None  # directory holding save sessions (current directory if None)
+        self.camera_name = ""  # camera name recorded with the save session
+        self.session = None  # current SaveSession, started on the first save
+        self.index = None  # BeamIndex shared with other processors saving to the same root
+        self.change_detector = None  # optional FrameChangeDetector to skip unchanged frames
+        self.timer = StageTimer()
+        # grayscale and colormap buffers reused every frame, and the capture buffers of
+        # an attached camera source
+        self.pool = FramePool()
+        self.memory = MemoryTracker(self.pool)
+
+    # Capture into this processor's buffer pool, so one memory budget covers the capture
+    # buffers as well. Returns the source
+    def attach(self, source):
+        source.pool = self.pool
+        return source
+
+    # Analyze one camera frame: grayscale, moments, centroid and D4σ.
+    # Optionally fit Gaussians to the profiles and save data if requested. With
+    # save=False the caller saves (e.g. a snapshot on another thread, see BeamMulti)
+    def process(self, image_live, fit=True, save=True):
+        self.saved_to = None
+        self.memory.start_frame()
+        detector = self.change_detector
+        if detector is not None:
+            # a save which writes files (single save, first frame of a log) always gets a
+            # freshly analysed frame, which the next frames are then compared with
+            if self.image is None or (self.SAVE_NOW and not self.can_record_unchanged()):
+                detector.update(image_live)
+            elif not detector.changed(image_live):
+                self.reuse(detector, fit, save)
+                self.memory.end_frame()
+                return self.metrics
+        A = time.perf_counter()
+        self.analyze(image_live)
+        B = time.perf_counter()
+        self.timer.add("analyze", B - A)
+        if fit:
+            self.fit_profiles()
+            C = time.perf_counter()
+            self.timer.add("fit", C - B)
+        if save and self.SAVE_NOW:
+            C = time.perf_counter()
+            self.save_latest()
+            self.timer.add("save", time.perf_counter() - C)
+        self.memory.end_frame()
+        return self.metrics
+
+    # Nothing meaningful changed: keep the last analysis, fits and colormap and only
+    # advance the frame number and timestamp (logging still records the frame)
+    def reuse(self, detector, fit, save=True):
+        skipped = detector.skipped
+        self.frame_count += 1
+        self.metrics.update(frame=self.frame_count, timestamp=time.time(), reused=True)
+        skipped["analyze"] += 1
+        if fit:
+            skipped["fit"] += 1
+        if save and self.SAVE_NOW:
+            A = time.perf_counter()
+            self.save_latest()
+            self.timer.add("save", time.perf_counter() - A)
+        return self.metrics
+
+    # Save the latest frame. While logging, a reused frame is only recorded in the index
+    # (timestamp and metrics, pointing at the saved analysed frame) instead of writing files again
+    def save_latest(self):
+        if self.metrics.get("reused") and self.can_record_unchanged():
+            result = self.record_unchanged()
+            detector = self.change_detector
+            if detector is not None:
+                detector.skipped["save"] += 1
+            return result
+        return self.save()
+
+    # True if the frame the current results were analysed from is saved in this session
+    def can_record_unchanged(self):
+        processed = self.processed
+        return (
+            self.LOGGING
+            and self.session is not None
+            and processed is not None
+            and processed["seq"] is not None
+            and processed["session"] is self.session
+        )
+
+    def record_unchanged(self):
+        A = time.perf_counter()
+        session = self.session
+        seq, timestamp_us = self.reserved or session.next_frame()
+        metrics = dict(self.metrics, same_as=self.processed["seq"])
+        session.record(seq, timestamp_us, metrics, [], self.notes)
+        self.saved_to = session.path
+        self.last_save = {
+            "path": session.path,
+            "seq": seq,
+            "files": 0,
+            "bytes": 0,
+            "ms": 1000.0 * (time.perf_counter() - A),
+        }
+        return self.last_save
+
+    # Compute the centroid and D4σ of a camera frame
+    def analyze(self, image_live):
+        self.frame_count += 1
+        self.image_live = image_live
+        self.H, self.W = image_live.shape[:2]
+        self.beam_image = None
+        self.processed = {"session": None, "seq": None}
+        # fits of the previous frame must not be saved or published with this one
+        for key in [key for key in self.metrics if key.startswith("fit_")]:
+            del self.metrics[key]
+        self.profiles = None
+
+        # Convert the live image to grayscale for intensity profiling
+        image = cv2.cvtColor(image_live, cv2.COLOR_BGR2GRAY, dst=self.pool.buffer("gray", (self.H, self.W)))
+        self.image = image
+
+        # Compute the centroid and D4σ in pixel values if the image is not empty
+        MOM = cv2.moments(image)
+        if MOM["m00"] != 0:
+            centroid_x = MOM["m10"] / MOM["m00"]
+            centroid_y = MOM["m01"] / MOM["m00"]
+
+            # Calculate the D4σ in physical units (using pixel size in microns)
+            d4x = (
+                self.pixel_um
+                * 4
+                * math.sqrt(abs(MOM["m20"] / MOM["m00"] - centroid_x**2))
+            )
+            d4y = (
+                self.pixel_um
+                * 4
+                * math.sqrt(abs(MOM["m02"] / MOM["m00"] - centroid_y**2))
+            )
+        else:
+            centroid_x = self.mask_x
+            centroid_y = self.mask_y
+            d4x = 0
+            d4y = 0
+
+        # Histogram, peak value and number of saturated pixels. Saturation clips the
+        # beam and corrupts D4σ and the Gaussian fits
+        self.histogram = cv2.calcHist([image], [0], None, [256], [0, 256]).ravel()
+        lit = np.flatnonzero(self.histogram)
+        peak = int(lit[-1]) if len(lit) else 0
+        saturated = int(self.histogram[255])
+
+        self.metrics.update(
+            frame=self.frame_count,
+            timestamp=time.time(),
+            centroid_x=float(centroid_x),
+            centroid_y=float(centroid_y),
+            d4x=float(d4x),
+            d4y=float(d4y),
+            reused=False,
+            peak=peak,
+            saturated_pixels=saturated,
+        )
+        return self.metrics
+
+    # Fit Gaussians to the x and y profiles through the centroid
+    def fit_profiles(self):
+        image = self.image
+        cy = min(max(round(self.metrics["centroid_y"]), 0), self.H - 1)
+        cx = min(max(round(self.metrics["centroid_x"]), 0), self.W - 1)
+
+        # Extract x and y profiles centered at the centroid (copied, the grayscale
+        # buffer is overwritten by the next frame)
+        x_prof = image[cy, :].copy()
+        y_prof = image[:, cx].copy()
+
+        fitted = []
+        for axis, prof in (("x", x_prof), ("y", y_prof)):
+            try:
+                popt = fit_gaussian(prof)
+            except (RuntimeError, ValueError):
+                # fit did not converge (e.g. dark frame); report NaN instead of stopping
+                popt = np.array([np.nan, np.nan, np.nan])
+            fitted.append(gaussian(np.arange(len(prof)), *popt))
+
+            # Store the fit parameters with the frame metrics
+            self.metrics["fit_" + axis + "_a"] = float(popt[0])
+            self.metrics["fit_" + axis + "_x0"] = float(popt[1])
+            self.metrics["fit_" + axis + "_sigma"] = float(abs(popt[2]))
+            self.metrics["fit_" + axis + "_fwhm"] = float(full_width_half_maximum(abs(popt[2])))
+
+        self.profiles = (x_prof, y_prof, fitted[0], fitted[1])
+        return self.profiles
+
+    # Rainbow colormap of the inverted grayscale image (computed once per frame)
+    def colormap(self):
+        if self.beam_image is None:
+            self.beam_image = cv2.applyColorMap(
+                self.image, INVERTED_RAINBOW, dst=self.pool.buffer("beam", (self.H, self.W, 3))
+            )
+        return self.beam_image
+
+    # Save images, statistics and profiles of the latest frame into the current save
+    # session (started under save_root, the current directory by default, on the
+    # first save). Returns the session directory, frame sequence number, number of
+    # files, bytes written and save latency
+    def save(self):
+        A = time.perf_counter()
+        session = self.open_session()
+        seq, timestamp_us = self.reserved or session.next_frame()
+        image = self.image
+        metrics = self.metrics
+        save_prefix = self.save_prefix
+
+        # Save the live image and beam profile with the selected codec
+        files = [
+            session.write_frame(save_prefix, "camera", seq, self.image_live, self.frame_codec),
+            session.write_frame(save_prefix, "beam", seq, self.colormap(), self.frame_codec),
+        ]
+
+        # Profiles through the centroid
+        cy = min(max(round(metrics["centroid_y"]), 0), self.H - 1)
+        cx = min(max(round(metrics["centroid_x"]), 0), self.W - 1)
+        x_prof = image[cy, :]
+        y_prof = image[:, cx]
+
+        # Statistics and profiles in a single .npz (or vectorized CSV)
+        stats = {
+            "seq": seq,
+            "timestamp_us": timestamp_us,
+            "width": self.W,
+            "height": self.H,
+            "centroid_x": metrics["centroid_x"],
+            "centroid_y": metrics["centroid_y"],
+            "d4x": metrics["d4x"],
+            "d4y": metrics["d4y"],
+            "saturated_pixels": metrics["saturated_pixels"],
+        }
+        stats.update(frame_stats(image, self.dark_pixel_threshold, self.histogram))
+        stats.update((k, v) for k, v in metrics.items() if k.startswith("fit_"))
+        for path in write_data(session.path_base(save_prefix, "data", seq), stats, x_prof, y_prof, self.data_format):
+            files.append(session.file_entry("data", path))
+
+        # Save additional information entered by the user in a text file
+        if self.notes:
+            notes_path = session.path_base(save_prefix, "entered_info", seq) + ".txt"
+            with open(notes_path, "w") as small_text_file:
+                small_text_file.write(self.notes)
+            files.append(session.file_entry("notes", notes_path))
+
+        # Profile plots only when requested, from one reused off-screen figure
+        if self.save_plots:
+            if self.plotter is None:
+                self.plotter = ProfilePlotter()
+            for kind, prof, title in (
+                ("x_profile", x_prof, "Beam profile along x-axis at y-centroid"),
+                ("y_profile", y_prof, "Beam profile along y-axis at x-centroid"),
+            ):
+                path = self.plotter.plot(session.path_base(save_prefix, kind, seq) + ".png", prof, title)
+                files.append(session.file_entry(kind, path))
+
+        # Record the frame in the session index; single saves are committed right away
+        session.record(seq, timestamp_us, metrics, files, self.notes, commit=not self.LOGGING)
+        if self.processed is not None:
+            self.processed.update(session=session, seq=seq)
+
+        # Save once unless logging continuously
+        if not self.LOGGING:
+            self.SAVE_NOW = False
+        self.saved_to = session.path
+        self.last_save = {
+            "path": session.path,
+            "seq": seq,
+            "files": len(files),
+            "bytes": sum(entry[3] for entry in files),
+            "ms": 1000.0 * (time.perf_counter() - A),
+        }
+        return self.last_save
+
+    # Start/stop continuous logging. Stopping commits the index rows still batched, so the
+    # last frames of the log can be queried right away and survive a crash
+    def set_logging(self, enabled):
+        self.LOGGING = bool(enabled)
+        self.SAVE_NOW = bool(enabled)
+        if not enabled and self.session is not None:
+            self.session.index.commit(force=True)
+
+    # Start the save session now instead of on the first save
+    def open_session(self):
+        if self.session is None:
+            self.session = SaveSession(self.save_root, self.camera_name, self.index)
+        return self.session
+
+    # Copy of the latest frame's state which can be saved from another thread while this
+    # processor moves on to the next frame. Saves must then all run on a single thread.
+    # The frames are copied out of the reused buffers. The sequence number is reserved
+    # here, so the following reused frames can point at an analysed frame right away
+    def snapshot(self):
+        session = self.open_session()
+        self.colormap()
+        snapshot = copy.copy(self)
+        snapshot.metrics = dict(self.metrics)
+        snapshot.pool = None
+        snapshot.reserved = session.next_frame()
+        if self.metrics.get("reused") and self.can_record_unchanged():
+            # only recorded in the index, the frames are not needed
+            snapshot.image_live = snapshot.image = snapshot.beam_image = None
+        else:
+            snapshot.image_live = self.image_live.copy()
+            snapshot.image = self.image.copy()
+            snapshot.beam_image = self.beam_image.copy()
+            if self.processed is not None:
+                self.processed.update(session=session, seq=snapshot.reserved[0])
+        return snapshot
+
+    # Finish the current save session; the next save starts a new one
+    def close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+# Capture, analyse and colormap `frames` simulated frames at one resolution and report
+# the memory used. Run in a fresh process per resolution (see benchmark_memory) so the
+# peak RSS belongs to that resolution alone
+def measure_memory(resolution, frames=10, reuse=True, cap_mb=None, fit=False):
+    import resource
+
+    processor = BeamProcessor()
+    processor.pool = FramePool(cap_mb, reuse)
+    processor.memory = MemoryTracker(processor.pool)
+    source = SimulatedCameraSource(CameraSettings(resolution=resolution), noise=0)
+    source.open()
+    # the simulator's arrays (beam profile, float working buffers) do not exist on a real
+    # camera: allocate them with a first capture and report the memory on top of them
+    source.capture()
+    source.pool.clear()
+    processor.attach(source)
+    baseline = current_rss()
+    # warm-up frames allocate the buffers, the measured frames run in steady state
+    for _ in range(CAPTURE_BUFFERS):
+        processor.process(source.capture(), fit=fit)
+        processor.colormap()
+    allocations = processor.pool.allocations
+    tracker = MemoryTracker(processor.pool, trace=True)
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    A = time.perf_counter()
+    for _ in range(frames):
+        tracker.start_frame()
+        processor.process(source.capture(), fit=fit)
+        processor.colormap()
+        tracker.end_frame()
+    seconds = time.perf_counter() - A
+    tracemalloc.stop()
+    return {
+        "resolution": "x".join(str(n) for n in resolution),
+        "reuse": reuse,
+        "baseline_mb": baseline / 1e6,
+        "peak_rss_mb": tracker.peak_rss / 1e6,
+        "pipeline_mb": (tracker.peak_rss - baseline) / 1e6,
+        "pool_mb": processor.pool.nbytes / 1e6,
+        "allocations_per_frame": (processor.pool.allocations - allocations) / frames,
+        "frame_peak_mb": tracker.max_frame_peak_bytes / 1e6,
+        "page_faults_per_frame": (resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults) / frames,
+        "ms_per_frame": 1000.0 * seconds / frames,
+    }
+
+
+# Peak memory per resolution with reused buffers and, for comparison, with a fresh
+# allocation for every buffer of every frame. Each measurement runs in its own process
+def benchmark_memory(resolutions=RESOLUTIONS, frames=10, cap_mb=None, fit=False):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for resolution in resolutions:
+        for reuse in (False, True):
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                future = executor.submit(measure_memory, resolution, frames, reuse, cap_mb if reuse else None, fit)
+                try:
+                    results.append(future.result())
+                except MemoryError as e:
+                    results.append({"resolution": "x".join(str(n) for n in resolution), "reuse": reuse, "error": str(e)})
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Peak memory of the frame pipeline per resolution")
+    parser.add_argument("--frames", type=int, default=10, help="frames per measurement")
+    parser.add_argument("--cap-mb", type=float, default=None, help="memory budget for the frame buffers in MB")
+    parser.add_argument("--fit", action="store_true", help="include the Gaussian profile fits")
+    parser.add_argument("--resolution", action="append", help="resolution to measure, e.g. 4056x3040 (default: all)")
+    args = parser.parse_args()
+
+    resolutions = [CameraSettings(resolution=r).resolution for r in args.resolution] if args.resolution else RESOLUTIONS
+    print(
+        "{:>10}{:>8}{:>13}{:>13}{:>9}{:>13}{:>14}{:>14}{:>8}".format(
+            "size", "buffers", "baseline MB", "pipeline MB", "pool MB", "alloc/frame", "transient MB", "faults/frame", "ms"
+        )
+    )
+    for result in benchmark_memory(resolutions, args.frames, args.cap_mb, args.fit):
+        reuse = "pooled" if result["reuse"] else "fresh"
+        if "error" in result:
+            print("{:>10}{:>8}  {}".format(result["resolution"], reuse, result["error"]))
+            continue
+        print(
+            "{:>10}{:>8}{:>13.1f}{:>13.1f}{:>9.1f}{:>13.1f}{:>14.1f}{:>14.0f}{:>8.1f}".format(
+                result["resolution"],
+                reuse,
+                result["baseline_mb"],
+                result["pipeline_mb"],
+                result["pool_mb"],
+                result["allocations_per_frame"],
+                result["frame_peak_mb"],
+                result["page_faults_per_frame"],
+                result["ms_per_frame"],
+            )
+        )
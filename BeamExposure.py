@@ -0,0 +1,153 @@
+# Vyir
+# Vyirtech.com
+
+# Closed-loop auto-exposure for the beam profiler. The controller adjusts the camera
+# shutter speed from the per-frame peak value and histogram so that the beam peak sits
+# at a target fraction of full scale without saturating the sensor.
+# Run `python BeamExposure.py` to measure convergence on the simulated camera.
+
+# required imports
+import numpy as np
+
+from BeamCore import BeamProcessor, CameraSettings, SimulatedCameraSource
+
+FULL_SCALE = 255  # largest pixel value of the 8-bit sensor output
+
+
+# Shutter speed controller driven by the beam peak and saturated pixel count
+class ExposureController:
+    def __init__(
+        self,
+        target_fill=0.8,
+        tolerance=0.05,
+        max_saturated=0,
+        min_count=1,
+        min_shutter=10,
+        max_shutter=1000000,
+        damping=0.8,
+        max_step=4.0,
+        holdoff=1,
+        settle_frames=3,
+    ):
+        self.target_fill = target_fill  # target peak as fraction of full scale
+        self.tolerance = tolerance  # accepted deviation of the peak, fraction of full scale
+        self.max_saturated = max_saturated  # saturated pixels allowed before backing off
+        self.min_count = min_count  # pixels needed in a histogram bin to count as the peak (rejects hot pixels)
+        self.min_shutter = min_shutter  # shutter limits in μs
+        self.max_shutter = max_shutter
+        self.damping = damping  # exponent applied to the correction ratio (1 = full step)
+        self.max_step = max_step  # largest factor the shutter may change by in one step
+        self.holdoff = holdoff  # frames to wait after a change before it shows in the image
+        self.settle_frames = settle_frames  # consecutive in-band frames counted as settled
+        self.enabled = True
+        self.reset()
+
+    # Start a new settling measurement
+    def reset(self):
+        self.frames = 0  # frames seen since the last reset
+        self.adjustments = 0  # shutter changes made since the last reset
+        self.in_band = 0  # consecutive frames within tolerance
+        self.settling_frames = None  # frames until settled, None while still settling
+        self._wait = 0
+
+    @property
+    def settled(self):
+        return self.settling_frames is not None
+
+    # Peak value from the histogram, ignoring bins with fewer than min_count pixels
+    def peak(self, histogram):
+        lit = np.flatnonzero(histogram >= self.min_count)
+        return int(lit[-1]) if len(lit) else 0
+
+    # Feed one frame. Returns the new shutter speed, or None if it should stay unchanged
+    def update(self, histogram, shutter):
+        self.frames += 1
+        if self._wait > 0:
+            self._wait -= 1
+            return None
+
+        target = self.target_fill * FULL_SCALE
+        peak = self.peak(histogram)
+        saturated = int(histogram[FULL_SCALE])
+
+        if saturated > self.max_saturated:
+            # the true peak is unknown once clipped: back off by the largest step
+            factor = 1.0 / self.max_step
+        elif abs(peak - target) <= self.tolerance * FULL_SCALE:
+            self.in_band += 1
+            if self.settling_frames is None and self.in_band >= self.settle_frames:
+                self.settling_frames = self.frames - self.settle_frames + 1
+            return None
+        else:
+            factor = (target / max(peak, 1)) ** self.damping
+            factor = min(max(factor, 1.0 / self.max_step), self.max_step)
+
+        # out of band: a settled loop starts a new settling measurement
+        self.in_band = 0
+        if self.settling_frames is not None:
+            self.reset()
+            self.frames = 1
+
+        new_shutter = int(round(min(max(shutter * factor, self.min_shutter), self.max_shutter)))
+        if new_shutter == shutter:
+            return None
+        self.adjustments += 1
+        self._wait = self.holdoff
+        return new_shutter
+
+    # Update from the processor's latest frame and apply a new shutter speed to the
+    # open camera source. Returns the new shutter speed or None
+    def apply(self, processor, source):
+        # a reused frame carries the histogram of an earlier frame
+        if not self.enabled or processor.histogram is None or processor.metrics.get("reused"):
+            return None
+        shutter = self.update(processor.histogram, source.settings.shutter_speed)
+        if shutter is not None:
+            source.reconfigure(source.settings.copy().update(shutter_speed=shutter))
+        return shutter
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "target_fill": self.target_fill,
+            "frames": self.frames,
+            "adjustments": self.adjustments,
+            "settled": self.settled,
+            "settling_frames": self.settling_frames,
+        }
+
+
+# Run the controller against the simulated camera until it settles.
+# Returns (settling frames or None, final shutter speed, final peak)
+def simulate_convergence(shutter, rate=0.2, resolution=(640, 480), max_frames=100, **controller_args):
+    source = SimulatedCameraSource(CameraSettings(resolution=resolution, shutter_speed=shutter), rate=rate)
+    source.open()
+    processor = BeamProcessor()
+    controller = ExposureController(**controller_args)
+    for _ in range(max_frames):
+        processor.analyze(source.capture())
+        controller.apply(processor, source)
+        if controller.settled:
+            break
+    return controller.settling_frames, source.settings.shutter_speed, processor.metrics["peak"]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Auto-exposure convergence on the simulated camera")
+    parser.add_argument("--target-fill", type=float, default=0.8, help="target peak as fraction of full scale")
+    parser.add_argument("--holdoff", type=int, default=1, help="frames to wait after each shutter change")
+    args = parser.parse_args()
+
+    print("{:>10}{:>8}{:>12}{:>16}{:>8}".format("start μs", "rate", "settled in", "final shutter", "peak"))
+    for rate in (0.05, 0.2, 1.0):
+        for shutter in (10, 100, 1000, 10000, 100000):
+            frames, final, peak = simulate_convergence(
+                shutter, rate=rate, target_fill=args.target_fill, holdoff=args.holdoff
+            )
+            print(
+                "{:>10}{:>8}{:>12}{:>16}{:>8}".format(
+                    shutter, rate, "-" if frames is None else str(frames) + " fr", final, peak
+                )
+            )
@@ -0,0 +1,355 @@
+# Vyir
+# Vyirtech.com
+
+# Headless operation of the beam profiler. BeamDaemon runs capture and beam analysis
+# without any Qt widgets and can be controlled from Python or through a local
+# HTTP control endpoint (ControlServer). Run with `python BeamHeadless.py`.
+# The GUI is a client of a BeamDaemon as well: it runs the daemon's step() and renders
+# the results.
+#
+# Control endpoint (JSON):
+#   GET  /status    running state, settings, logging flag, frame rate and stage timings
+#   GET  /metrics   latest per-frame metrics
+#   POST /start     start capture
+#   POST /stop      stop capture
+#   POST /save      save data of the next frame once
+#   POST /logging   {"enabled": true|false} start/stop continuous logging
+#   POST /settings  {"shutter_speed": 2000, ...} change camera settings
+#   POST /auto_exposure  {"enabled": true, "target_fill": 0.8} closed-loop shutter control
+#   POST /change_detection  {"enabled": true, "threshold": 1.0, "refresh_every": 30}
+#                   skip analysis of frames which did not change
+
+# required imports
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from BeamCore import BeamProcessor, CameraSettings, FrameChangeDetector, PiCameraSource, SettingsMailbox
+from BeamExposure import ExposureController
+from BeamStorage import DATA_FORMATS, FRAME_CODECS
+
+
+# Capture and analysis loop running in a background thread, with a small control API
+class BeamDaemon:
+    def __init__(self, settings=None, source_factory=PiCameraSource, fit=True, server=None, auto_exposure=False):
+        self.settings = settings if settings is not None else CameraSettings()
+        self.source_factory = source_factory  # called with the settings to create a camera source
+        self.fit = fit  # fit Gaussians to the profiles every frame
+        self.server = server  # optional BeamStreamServer
+        self.processor = BeamProcessor()
+        self.mailbox = SettingsMailbox()  # live settings changes for the capture loop
+        self.exposure = ExposureController()  # closed-loop shutter control
+        self.exposure.enabled = auto_exposure
+        self.source = None
+        self.running = False
+        self.error = None  # last error raised by the capture loop
+        # (milliseconds, resized) of settings applied before the latest frame, None if there were none
+        self.reconfigured = None
+        self.started_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # Open the camera and start the capture loop. With thread=False the caller runs the
+    # loop by calling step() (the GUI capture thread). If the camera cannot be opened the
+    # error is kept for status() and raised
+    def start(self, thread=True):
+        with self._lock:
+            if self.running:
+                return False
+            self.error = None
+            try:
+                self.source = self.processor.attach(self.source_factory(self.settings.copy()))
+                self.source.open()
+            except Exception as e:
+                self.error = repr(e)
+                self.source = None
+                raise
+            self.processor.timer.reset()
+            self.processor.frame_count = 0
+            self.running = True
+            self.started_at = time.perf_counter()
+            if thread:
+                self._thread = threading.Thread(target=self._run, name="BeamDaemon", daemon=True)
+                self._thread.start()
+            return True
+
+    # Stop the capture loop and close the camera. Without a capture thread, call it from
+    # the thread which runs step()
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self.running = False
+            if self._thread is not None and self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+            self.source.close()
+            self.processor.close_session()
+            return True
+
+    # Change camera settings. A running camera is reconfigured live between two
+    # frames; with wait=True this returns once the new settings are in effect and
+    # raises ValueError if the camera rejected them (it then keeps the previous ones)
+    def apply_settings(self, wait=True, timeout=10.0, **values):
+        settings = self.settings.copy().update(**values)
+        self.settings = settings
+        if self.running:
+            ticket = self.mailbox.post(settings)
+            if wait and self.mailbox.wait(ticket, timeout):
+                error = self.mailbox.error
+                if self.mailbox.applied == ticket and error is not None:
+                    raise ValueError("Camera settings not applied: " + error)
+        return self.settings.as_dict()
+
+    # Enable/disable auto exposure, optionally with a new target peak fill
+    def set_auto_exposure(self, enabled, target_fill=None):
+        if target_fill is not None:
+            self.exposure.target_fill = float(target_fill)
+        if enabled:
+            self.exposure.reset()
+        self.exposure.enabled = bool(enabled)
+        return self.exposure.status()
+
+    # Enable/disable skipping of unchanged frames, optionally changing the threshold
+    # and the forced refresh interval
+    def set_change_detection(self, enabled, threshold=None, refresh_every=None):
+        detector = self.processor.change_detector
+        if detector is None:
+            detector = FrameChangeDetector()
+        if threshold is not None:
+            detector.threshold = float(threshold)
+        if refresh_every is not None:
+            detector.refresh_every = int(refresh_every)
+        self.processor.change_detector = detector if enabled else None
+        return detector.status() if enabled else None
+
+    # Start/stop continuous logging of data
+    def set_logging(self, enabled):
+        self.processor.set_logging(enabled)
+
+    # Save data of the next frame once
+    def save(self):
+        self.processor.SAVE_NOW = True
+
+    def latest_metrics(self):
+        return dict(self.processor.metrics)
+
+    # Running state, frame rate and mean milliseconds spent per pipeline stage
+    def status(self):
+        frames = self.processor.frame_count
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "running": self.running,
+            "error": self.error,
+            "settings": self.settings.as_dict(),
+            "logging": self.processor.LOGGING,
+            "auto_exposure": self.exposure.status(),
+            "change_detection": (
+                self.processor.change_detector.status()
+                if self.processor.change_detector is not None
+                else None
+            ),
+            "frames": frames,
+            "fps": frames / elapsed if elapsed > 0 else 0.0,
+            "stage_ms": self.processor.timer.report(),
+            "memory": self.processor.memory.status(),
+            "last_save": self.processor.last_save,
+            "settings_error": self.mailbox.error,
+            "reconfigure_ms": [
+                {"ms": ms, "resolution_changed": resized, "error": error}
+                for ms, resized, error in self.mailbox.history
+            ],
+        }
+
+    # One frame: apply pending settings, capture, analyse (and save), adjust the exposure
+    # and publish. Returns the captured frame, or None if the capture loop failed
+    def step(self):
+        processor = self.processor
+        timer = processor.timer
+        try:
+            self.reconfigured = self.mailbox.apply_pending(self.source)
+            if self.reconfigured is not None and self.mailbox.error is not None:
+                # the camera kept its previous settings
+                self.settings = self.source.settings.copy()
+            A = time.perf_counter()
+            image_live = self.source.capture()
+            timer.add("capture", time.perf_counter() - A)
+            processor.process(image_live, fit=self.fit)
+            if self.exposure.enabled:
+                shutter = self.exposure.apply(processor, self.source)
+                if shutter is not None:
+                    self.settings.shutter_speed = shutter
+            if self.server is not None:
+                B = time.perf_counter()
+                self.server.publish(processor.metrics, image_live)
+                timer.add("publish", time.perf_counter() - B)
+            timer.add("frame", time.perf_counter() - A)
+            return image_live
+        except Exception as e:
+            # keep the daemon reachable and report the failure through status()
+            self.error = repr(e)
+            self.running = False
+            self.source.close()
+            self.processor.close_session()
+            return None
+
+    def _run(self):
+        while self.running:
+            self.step()
+
+
+# Request handler for the local control endpoint; the daemon is attached to the server
+class ControlHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        daemon = self.server.daemon
+        if self.path == "/status":
+            self._reply(200, daemon.status())
+        elif self.path == "/metrics":
+            self._reply(200, daemon.latest_metrics())
+        else:
+            self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        daemon = self.server.daemon
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/start":
+                self._reply(200, {"started": daemon.start()})
+            elif self.path == "/stop":
+                self._reply(200, {"stopped": daemon.stop()})
+            elif self.path == "/save":
+                daemon.save()
+                self._reply(200, {"save": True})
+            elif self.path == "/logging":
+                daemon.set_logging(body.get("enabled", True))
+                self._reply(200, {"logging": daemon.processor.LOGGING})
+            elif self.path == "/auto_exposure":
+                status = daemon.set_auto_exposure(body.get("enabled", True), body.get("target_fill"))
+                self._reply(200, {"auto_exposure": status})
+            elif self.path == "/change_detection":
+                status = daemon.set_change_detection(
+                    body.get("enabled", True), body.get("threshold"), body.get("refresh_every")
+                )
+                self._reply(200, {"change_detection": status})
+            elif self.path == "/settings":
+                self._reply(200, {"settings": daemon.apply_settings(**body)})
+            else:
+                self._reply(404, {"error": "Not found"})
+        except (ValueError, TypeError) as e:
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            # e.g. the camera could not be opened (no PiCamera, picamera not installed)
+            self._reply(500, {"error": repr(e)})
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # keep the console quiet when running unattended
+    def log_message(self, format, *args):
+        pass
+
+
+# Local HTTP control endpoint for a BeamDaemon (binds to localhost by default)
+class ControlServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, daemon, host="127.0.0.1", port=8766):
+        ThreadingHTTPServer.__init__(self, (host, port), ControlHandler)
+        self.daemon = daemon
+        self._thread = None
+
+    # Serve requests from a background thread
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="ControlServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Headless Raspberry Pi laser beam profiler")
+    parser.add_argument("--resolution", default="640x480", help="camera resolution, e.g. 1920x1080")
+    parser.add_argument("--shutter", type=int, default=1000, help="shutter speed (μs)")
+    parser.add_argument("--iso", type=int, default=1, help="camera ISO")
+    parser.add_argument("--auto-exposure", action="store_true", help="adjust the shutter speed to avoid saturation")
+    parser.add_argument("--target-fill", type=float, default=0.8, help="auto-exposure target peak (fraction of 255)")
+    parser.add_argument(
+        "--skip-unchanged",
+        type=float,
+        default=None,
+        metavar="THRESHOLD",
+        help="skip frames whose mean absolute difference is below THRESHOLD gray levels",
+    )
+    parser.add_argument("--refresh-every", type=int, default=30, help="process at least every Nth frame when skipping")
+    parser.add_argument("--no-fit", action="store_true", help="skip the Gaussian profile fits")
+    parser.add_argument("--memory-cap", type=float, default=None, help="memory budget for the frame buffers in MB")
+    parser.add_argument("--control-host", default="127.0.0.1", help="address for the control endpoint")
+    parser.add_argument("--control-port", type=int, default=8766, help="port for the control endpoint")
+    parser.add_argument("--serve", action="store_true", help="publish metrics and previews to remote dashboards")
+    parser.add_argument("--serve-host", default="127.0.0.1", help="address for the streaming server")
+    parser.add_argument("--serve-port", type=int, default=8765, help="HTTP port (WebSocket metrics, MJPEG preview)")
+    parser.add_argument("--binary-port", type=int, default=None, help="optional port for length-prefixed binary metrics")
+    parser.add_argument("--preview-every", type=int, default=5, help="send every Nth frame as MJPEG preview")
+    parser.add_argument("--log", action="store_true", help="start logging data immediately")
+    parser.add_argument("--codec", choices=FRAME_CODECS, default="png", help="codec for saved frames")
+    parser.add_argument("--data-format", choices=DATA_FORMATS, default="npz", help="format for profiles and statistics")
+    parser.add_argument("--plots", action="store_true", help="also save profile plots")
+    parser.add_argument("--save-root", default=None, help="directory for save sessions and the index")
+    args = parser.parse_args()
+
+    server = None
+    if args.serve:
+        from BeamServer import BeamStreamServer
+
+        server = BeamStreamServer(
+            host=args.serve_host,
+            port=args.serve_port,
+            binary_port=args.binary_port,
+            preview_every=args.preview_every,
+        ).start()
+
+    settings = CameraSettings(resolution=args.resolution, shutter_speed=args.shutter, iso=args.iso)
+    daemon = BeamDaemon(settings, fit=not args.no_fit, server=server, auto_exposure=args.auto_exposure)
+    daemon.exposure.target_fill = args.target_fill
+    daemon.processor.frame_codec = args.codec
+    daemon.processor.data_format = args.data_format
+    daemon.processor.save_plots = args.plots
+    daemon.processor.save_root = args.save_root
+    daemon.processor.pool.cap_mb = args.memory_cap
+    if args.skip_unchanged is not None:
+        daemon.set_change_detection(True, args.skip_unchanged, args.refresh_every)
+    control = ControlServer(daemon, args.control_host, args.control_port).start()
+    print("Control endpoint on http://" + args.control_host + ":" + str(control.server_address[1]))
+    daemon.start()
+    if args.log:
+        daemon.set_logging(True)
+
+    try:
+        while True:
+            time.sleep(10)
+            status = daemon.status()
+            print(
+                "frames " + str(status["frames"])
+                + ", " + "{:.2f}".format(status["fps"]) + " fps, stage ms "
+                + ", ".join(k + "=" + "{:.1f}".format(v) for k, v in status["stage_ms"].items())
+                + ", peak RSS {:.0f} MB".format(status["memory"]["peak_rss_mb"] or 0)
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        control.stop()
+        if server is not None:
+            server.stop()
@@ -0,0 +1,304 @@
+# Vyir
+# Vyirtech.com
+
+# Several cameras on one host. Every camera source gets its own capture thread and
+# BeamProcessor; all of them share one analysis worker pool and one save writer
+# which serves the cameras round-robin, so a busy camera cannot starve the others.
+# Run e.g. `python BeamMulti.py --source pi --source usb:0 --source sim`.
+
+# required imports
+import collections
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from BeamCore import BeamProcessor, CameraSettings, FrameChangeDetector, make_source
+from BeamStorage import BeamIndex
+
+
+# Single thread writing saves for all cameras. Every camera has its own bounded queue
+# and the writer takes one save from each camera in turn
+class SaveWriter:
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size  # pending saves kept per camera before blocking or dropping
+        self.queues = collections.OrderedDict()
+        self.written = collections.Counter()
+        self.dropped = collections.Counter()
+        self.running = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add_camera(self, name):
+        with self._cond:
+            self.queues[name] = collections.deque()
+
+    # Queue a job for a camera: a callable run on the writer thread (e.g. the save_latest
+    # of a processor snapshot), with a callback receiving its result. With a full queue,
+    # block=True waits for the writer (logging must not lose frames); otherwise the
+    # oldest job is dropped (single saves, where only the latest matters)
+    def submit(self, name, job, done=None, block=False):
+        with self._cond:
+            queue = self.queues[name]
+            if block:
+                self._cond.wait_for(lambda: len(queue) < self.queue_size or not self.running)
+            elif len(queue) >= self.queue_size:
+                queue.popleft()
+                self.dropped[name] += 1
+            queue.append((job, done))
+            self._cond.notify_all()
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="SaveWriter", daemon=True)
+        self._thread.start()
+
+    # Stop after writing everything still queued
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    # Next job in round-robin order, or None when stopping with nothing queued
+    def _next_job(self):
+        with self._cond:
+            while True:
+                for name in list(self.queues):
+                    queue = self.queues[name]
+                    if queue:
+                        # move this camera to the back of the rotation
+                        self.queues.move_to_end(name)
+                        # wake cameras waiting for room in their queue
+                        self._cond.notify_all()
+                        return name, queue.popleft()
+                if not self.running:
+                    return None
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            name, (job, done) = job
+            result = job()
+            # saves return their result, other jobs (index commits) None
+            if result is not None:
+                self.written[name] += 1
+            if done is not None:
+                done(result)
+
+
+# Capture thread and per-camera state for one source. Frames are analysed on the
+# shared pool with at most one frame in flight, so every camera gets a fair share
+class CameraPipeline:
+    def __init__(self, name, source, runner):
+        self.name = name
+        self.runner = runner
+        self.processor = BeamProcessor()
+        self.processor.camera_name = name
+        self.processor.save_root = runner.save_root
+        self.processor.index = runner.index
+        self.processor.pool.cap_mb = runner.memory_cap_mb
+        self.source = self.processor.attach(source)
+        if runner.change_threshold is not None:
+            self.processor.change_detector = FrameChangeDetector(
+                runner.change_threshold, refresh_every=runner.refresh_every
+            )
+        self.running = False
+        self.error = None
+        self.captured = 0
+        self.analysed = 0
+        self._thread = None
+
+    def start(self):
+        self.source.open()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="capture-" + self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.source.close()
+
+    # Analyse one frame on the pool and hand a snapshot to the save writer if requested.
+    # All saves go through the writer, never from the pool threads
+    def _analyse(self, image_live):
+        processor = self.processor
+        processor.process(image_live, fit=self.runner.fit, save=False)
+        self.analysed += 1
+        if processor.SAVE_NOW:
+            if not processor.LOGGING:
+                processor.SAVE_NOW = False
+            self.runner.writer.submit(
+                self.name, processor.snapshot().save_latest, self._saved, block=processor.LOGGING
+            )
+
+    def _saved(self, result):
+        self.processor.last_save = result
+
+    # Capture the next frame while the previous one is being analysed
+    def _run(self):
+        pending = None
+        try:
+            while self.running:
+                image_live = self.source.capture()
+                self.captured += 1
+                if pending is not None:
+                    pending.result()
+                pending = self.runner.pool.submit(self._analyse, image_live)
+            if pending is not None:
+                pending.result()
+        except Exception as e:
+            self.error = repr(e)
+            self.running = False
+
+
+# Runs N camera pipelines with one shared analysis pool and one shared save writer
+class MultiCameraRunner:
+    def __init__(
+        self, workers=None, fit=True, save_root=None, change_threshold=None, memory_cap_mb=None, refresh_every=30
+    ):
+        self.fit = fit  # fit Gaussians to the profiles every frame
+        self.change_threshold = change_threshold  # skip unchanged frames below this difference (None: off)
+        self.refresh_every = refresh_every  # process at least every Nth frame when skipping
+        self.memory_cap_mb = memory_cap_mb  # memory budget for the frame buffers of each camera in MB
+        self.save_root = save_root or os.getcwd()
+        self.index = None  # one save index for all cameras, opened on start()
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.writer = SaveWriter()
+        self.pipelines = collections.OrderedDict()
+        self.started_at = None
+
+    # Add a camera from a source object or a description understood by make_source()
+    def add_source(self, name, source, settings=None):
+        if isinstance(source, str):
+            source = make_source(source, settings if settings is not None else CameraSettings())
+        self.writer.add_camera(name)
+        self.pipelines[name] = CameraPipeline(name, source, self)
+        return self.pipelines[name]
+
+    def start(self):
+        self.index = BeamIndex(self.save_root)
+        for pipeline in self.pipelines.values():
+            pipeline.processor.index = self.index
+        self.writer.start()
+        for pipeline in self.pipelines.values():
+            pipeline.start()
+        self.started_at = time.perf_counter()
+
+    def stop(self):
+        for pipeline in self.pipelines.values():
+            pipeline.running = False
+        for pipeline in self.pipelines.values():
+            pipeline.stop()
+        # write the saves still queued before closing the sessions
+        self.writer.stop()
+        self.pool.shutdown()
+        for pipeline in self.pipelines.values():
+            pipeline.processor.close_session()
+        self.index.close()
+
+    # Save the next frame of one camera (all cameras if name is None)
+    def save(self, name=None):
+        for pipeline in self.pipelines.values():
+            if name is None or pipeline.name == name:
+                pipeline.processor.SAVE_NOW = True
+
+    # Start/stop continuous logging on all cameras. When stopping, the index is committed
+    # again once the saves still queued for each camera have been written
+    def set_logging(self, enabled):
+        for name, pipeline in self.pipelines.items():
+            pipeline.processor.set_logging(enabled)
+            if not enabled:
+                self.writer.submit(name, functools.partial(self.index.commit, force=True), block=True)
+
+    # Per-camera and aggregate frame rates, plus save writer counters
+    def stats(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        cameras = {}
+        for name, pipeline in self.pipelines.items():
+            cameras[name] = {
+                "fps": pipeline.analysed / elapsed if elapsed > 0 else 0.0,
+                "frames": pipeline.analysed,
+                "saved": self.writer.written[name],
+                "save_dropped": self.writer.dropped[name],
+                "unchanged": (
+                    pipeline.processor.change_detector.unchanged
+                    if pipeline.processor.change_detector is not None
+                    else 0
+                ),
+                "memory": pipeline.processor.memory.status(),
+                "error": pipeline.error,
+                "metrics": dict(pipeline.processor.metrics),
+            }
+        return {
+            "fps": sum(camera["fps"] for camera in cameras.values()),
+            "cameras": cameras,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run several beam profiler cameras on one host")
+    parser.add_argument(
+        "--source",
+        action="append",
+        required=True,
+        help="camera source: pi, usb:<n>, cv:<path> or sim[:<seed>] (repeat for more cameras)",
+    )
+    parser.add_argument("--resolution", default="640x480", help="camera resolution for all sources")
+    parser.add_argument("--workers", type=int, default=None, help="analysis worker threads (default: CPU count)")
+    parser.add_argument("--no-fit", action="store_true", help="skip the Gaussian profile fits")
+    parser.add_argument(
+        "--skip-unchanged",
+        type=float,
+        default=None,
+        metavar="THRESHOLD",
+        help="skip frames whose mean absolute difference is below THRESHOLD gray levels",
+    )
+    parser.add_argument("--refresh-every", type=int, default=30, help="process at least every Nth frame when skipping")
+    parser.add_argument("--memory-cap", type=float, default=None, help="memory budget for the frame buffers of each camera in MB")
+    parser.add_argument("--log", action="store_true", help="log data from all cameras")
+    parser.add_argument("--save-root", default=None, help="directory for save sessions and the index")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    runner = MultiCameraRunner(
+        workers=args.workers,
+        fit=not args.no_fit,
+        save_root=args.save_root,
+        change_threshold=args.skip_unchanged,
+        memory_cap_mb=args.memory_cap,
+        refresh_every=args.refresh_every,
+    )
+    for n, spec in enumerate(args.source):
+        runner.add_source(spec.replace(":", "") + "_" + str(n), spec, CameraSettings(resolution=args.resolution))
+    runner.start()
+    if args.log:
+        runner.set_logging(True)
+
+    started = time.perf_counter()
+    try:
+        while args.seconds is None or time.perf_counter() - started < args.seconds:
+            time.sleep(2 if args.seconds is None else min(2, args.seconds))
+            stats = runner.stats()
+            print(
+                "aggregate {:.1f} fps | ".format(stats["fps"])
+                + " | ".join(
+                    name + " {:.1f} fps".format(camera["fps"])
+                    + ", saved {}, dropped {}".format(camera["saved"], camera["save_dropped"])
+                    + (" ERROR " + camera["error"] if camera["error"] else "")
+                    for name, camera in stats["cameras"].items()
+                )
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
@@ -6,59 +6,31 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QComboBox
 from PyQt5.QtCore import QThread
 import numpy as np
-import matplotlib.pyplot as plt
 import cv2
 import os
-import datetime
-from picamera.array import PiRGBArray
-from picamera import PiCamera
-import time
-import math
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from scipy.optimize import curve_fit
+from BeamCore import CameraSettings, display_scale
+from BeamHeadless import BeamDaemon
+from BeamStorage import DATA_FORMATS, FRAME_CODECS
 
 # ignore command line warnings
 import warnings
 
 warnings.filterwarnings("ignore")
 
-# Gaussian function that takes x values, amplitude (a),
-# center position (x0), and standard deviation (sigma) as input
-
-
-def gaussian(x, a, x0, sigma):
-    return a * np.exp(-((x - x0) ** 2) / (2 * sigma**2))
-
-
-# Fit a Gaussian curve to the given `data` and return the optimized
-# parameters: amplitude (a), center position (x0), and standard deviation (sigma)
-
-
-def fit_gaussian(data):
-    x = np.arange(len(data))
-    mean = np.sum(x * data) / np.sum(data)
-    sigma = np.sqrt(np.sum(data * (x - mean) ** 2) / np.sum(data))
-    popt, _ = curve_fit(
-        gaussian, x, data, p0=[np.max(data), mean, sigma], maxfev=100000
-    )
-    return popt
-
-
-# Calculate and return the full width at half maximum (FWHM) for
-# a Gaussian curve given its standard deviation (sigma)
-
-
-def full_width_half_maximum(sigma):
-    return sigma * np.sqrt(8 * np.log(2))
-
-
 # main GUI window definition
 class Ui_MainWindow(object):
     # set camera resolution which will be passed through the whole program
 
     W, H = 640, 480
 
+    # optional BeamStreamServer which publishes metrics/previews to remote dashboards
+    server = None
+
+    # memory budget for the frame buffers in MB (None: unlimited), see BeamCore.FramePool
+    memory_cap_mb = None
+
     # setup UI elements
 
     def setupUi(self, MainWindow):
@@ -133,6 +105,12 @@ class Ui_MainWindow(object):
         self.label_centroid.setText("Centroid (x,y) = 0, 0")
         self.label_centroid.setGeometry(QtCore.QRect(550, 540, 250, 30))
 
+        # Create a label warning about saturated pixels (saturation corrupts D4σ and the fits)
+        self.label_saturated = QtWidgets.QLabel(self.tab_2)
+        self.label_saturated.setFont(QtGui.QFont("Any", 12))
+        self.label_saturated.setStyleSheet("color: red")
+        self.label_saturated.setGeometry(QtCore.QRect(550, 570, 350, 30))
+
         # Create a label and LCD widget for displaying the d4 sigma in x-direction
         self.label_dx = QtWidgets.QLabel(self.tab_2)
         self.label_dx.setGeometry(QtCore.QRect(20, 230, 101, 41))
@@ -199,6 +177,17 @@ class Ui_MainWindow(object):
         self.lineEdit_savePrefix.setGeometry(QtCore.QRect(955, 45, 100, 23))
         self.lineEdit_savePrefix.setPlaceholderText("Enter prefix")
 
+        # Create combo boxes for the saved frame codec and data format, and a check box for profile plots
+        self.comboBox_codec = QtWidgets.QComboBox(self.centralwidget)
+        self.comboBox_codec.setGeometry(QtCore.QRect(1062, 45, 90, 23))
+        self.comboBox_codec.addItems(list(FRAME_CODECS))
+        self.comboBox_data_format = QtWidgets.QComboBox(self.centralwidget)
+        self.comboBox_data_format.setGeometry(QtCore.QRect(1158, 45, 60, 23))
+        self.comboBox_data_format.addItems(list(DATA_FORMATS))
+        self.checkBox_plots = QtWidgets.QCheckBox(self.centralwidget)
+        self.checkBox_plots.setGeometry(QtCore.QRect(1225, 45, 60, 23))
+        self.checkBox_plots.setText("Plots")
+
         # Create a plain text edit for displaying small text
         self.plainTextEdit_smallText = QtWidgets.QPlainTextEdit(self.centralwidget)
         self.plainTextEdit_smallText.setGeometry(QtCore.QRect(1000, 700, 535, 300))
@@ -316,6 +305,20 @@ class Ui_MainWindow(object):
         self.lineEdit_saturation.setGeometry(QtCore.QRect(820, 270, 80, 40))
         self.lineEdit_saturation.setText(str(int(0)))
 
+        # Create a check box for closed-loop auto exposure (adjusts the shutter speed)
+        self.checkBox_auto_exposure = QtWidgets.QCheckBox(self.tab)
+        self.checkBox_auto_exposure.setGeometry(QtCore.QRect(820, 320, 131, 31))
+        self.checkBox_auto_exposure.setText("Auto exposure")
+
+        # Create a check box and line edit for skipping frames which did not change
+        # (threshold: mean absolute difference in gray levels on a decimated grid)
+        self.checkBox_skip_unchanged = QtWidgets.QCheckBox(self.tab)
+        self.checkBox_skip_unchanged.setGeometry(QtCore.QRect(820, 350, 131, 31))
+        self.checkBox_skip_unchanged.setText("Skip unchanged")
+        self.lineEdit_change_threshold = QtWidgets.QLineEdit(self.tab)
+        self.lineEdit_change_threshold.setGeometry(QtCore.QRect(960, 350, 61, 31))
+        self.lineEdit_change_threshold.setText("1.0")
+
         # Create a push button for applying settings
         self.pushButton_apply = QtWidgets.QPushButton(MainWindow)
         self.pushButton_apply.setGeometry(QtCore.QRect(889, 45, 55, 23))
@@ -400,6 +403,30 @@ class Ui_MainWindow(object):
         self.pushButton_L.setText(_translate("MainWindow", "Log"))
         self.pushButton_apply.setText(_translate("MainWindow", "Apply"))
 
+    # Collect the camera settings entered in the "Camera" tab
+    def camera_settings(self):
+        return CameraSettings(
+            resolution=self.comboBox_resolution.currentText(),
+            awb_mode=self.comboBox_awb.currentText(),
+            awb_gains=(self.lineEdit_awb_gains_r.text(), self.lineEdit_awb_gains_b.text()),
+            brightness=self.lineEdit_brightness.text(),
+            meter_mode=self.comboBox_meter_mode.currentText(),
+            exposure_mode=self.comboBox_exposure_mode.currentText(),
+            exposure_compensation=self.lineEdit_exposure_comp.text(),
+            shutter_speed=self.lineEdit_shutter.text(),
+            iso=self.lineEdit_iso.text(),
+            saturation=self.lineEdit_saturation.text(),
+        )
+
+    # Show the settings actually used by the camera
+    def show_camera_readback(self, readback):
+        self.lineEdit_shutter.setText(str(readback["shutter_speed"]))
+        self.lineEdit_frame.setText(str(readback["framerate"]))
+        self.lineEdit_brightness.setText(str(readback["brightness"]))
+        self.lineEdit_exposure_comp.setText(str(readback["exposure_compensation"]))
+        self.lineEdit_iso.setText(str(readback["iso"]))
+        self.lineEdit_saturation.setText(str(readback["saturation"]))
+
     # run image acquisition and processing thread
     # Global variable for running state
     RUNNING = False
@@ -413,27 +440,26 @@ class Ui_MainWindow(object):
         else:
             self.lineEdit.setText("System already running")
 
-    # Apply new settings to the running system
+    # Apply new settings to the running system. The capture thread keeps running and
+    # applies the settings live to the open camera between two frames
     def apply(self):
         if self.RUNNING:
-            self.threadA.stop()
-            time.sleep(2)
-            self.threadA.stop_camera()
-            self.threadA.start()
-            self.RUNNING = False
+            try:
+                self.threadA.daemon.apply_settings(wait=False, **self.camera_settings().as_dict())
+            except ValueError as e:
+                self.lineEdit.setText("Settings not applied: " + str(e))
         else:
-            self.lineEdit.setText("System already running")
+            self.lineEdit.setText("Run the system before applying settings")
 
     # Start/stop logging of data
     def log(self):
         if self.RUNNING:
-            if not self.threadA.LOGGING:
-                self.threadA.SAVE_NOW = True
-                self.threadA.LOGGING = True
+            daemon = self.threadA.daemon
+            if not daemon.processor.LOGGING:
+                daemon.set_logging(True)
                 self.pushButton_L.setText("Stop")
             else:
-                self.threadA.SAVE_NOW = False
-                self.threadA.LOGGING = False
+                daemon.set_logging(False)
                 self.pushButton_L.setText("Log")
                 self.lineEdit.setText("Data logging stopped")
         else:
@@ -442,7 +468,7 @@ class Ui_MainWindow(object):
     # Save images and statistics
     def save(self):
         if self.RUNNING:
-            self.threadA.SAVE_NOW = True
+            self.threadA.daemon.save()
         else:
             self.lineEdit.setText("Run the system before saving data")
 
@@ -450,32 +476,25 @@ class Ui_MainWindow(object):
 # thread which handles live image acquisition and beam image processing
 # runs separately from main GUI thread to prevent hang ups
 class captureThread(QThread):
-    # variables which can be accessed across functions and threads
-    image_live = np.empty(1)  # live camera image
-    camera = None  # camera variable for PiCamera
-    rawCapture = None  # rawCapture variable for PiCamera
-    MainWindow = None  # MainWindow passed to thread so thread can modify UI elements
-    SAVE_NOW = False  # flag to save all data once
-    LOGGING = False  # flag to continuously log data
-    # used to set camera and beam frame sizes and locations to draw images on
-    FRAMES_INIT = False
-    # used to reset aperture values if input is left blank
-    count_x, count_y, count_r = 0, 0, 0
-    # mask values for digital aperture. Changes based on text input
-    mask_x, mask_y, mask_r = 1296, 972, 880
-    W = 0  # camera/image width to be set
-    H = 0  # camera/image height to be set
-    # multiply a pixel width by 1.55 micron to get physical width #SENSOR DEPENDENT
-    pixel_um = 1.55
-
-    # initialize camera and set main window for interaction between thread and MainWindow
+    # initialize camera and set main window for interaction between thread and MainWindow.
+    # All state is per instance so several capture threads can run side by side
     def __init__(self, MainWindow, W, H):
         QThread.__init__(self)
-        # set the camera resolution
-
+        # set the camera resolution (camera/image width and height)
         self.W, self.H = W, H
-        self.MainWindow = MainWindow
+        self.MainWindow = MainWindow  # MainWindow passed to thread so thread can modify UI elements
+        self.image_live = np.empty(1)  # live camera image
+        # used to set camera and beam frame sizes and locations to draw images on
+        self.FRAMES_INIT = False
+        # used to reset aperture values if input is left blank
+        self.count_x, self.count_y, self.count_r = 0, 0, 0
         self.running = True
+        # capture, live settings, analysis, saving, auto exposure, change detection and
+        # publishing run in a BeamDaemon, as in headless operation; this thread runs it
+        # frame by frame and renders the results of its processor
+        self.daemon = BeamDaemon(MainWindow.camera_settings(), server=MainWindow.server)
+        self.processor = self.daemon.processor
+        self.processor.pool.cap_mb = MainWindow.memory_cap_mb
         self.init_camera()
 
     # capture live images and convert to beam profile
@@ -485,36 +504,31 @@ class captureThread(QThread):
     # Continuously run live image acquisition and beam analysis while the system is running
     def run(self):
         while self.running:
+            self.change_detection()
+            self.auto_exposure()
+            self.save_options()
+            # apply settings, capture, analyse, save, adjust the exposure and publish
+            self.image_live = self.daemon.step()
+            if self.image_live is None:
+                # the camera failed; the daemon has closed it
+                self.MainWindow.lineEdit.setText("Camera stopped: " + str(self.daemon.error))
+                self.MainWindow.RUNNING = False
+                return
+            self.show_settings()
             self.live_image()
             self.beam()
             self.update_live_chart()
+        self.daemon.stop()
 
     # Update the live charts for x and y profiles with the latest data
     def update_live_chart(self):
-        # Create an empty mask of the same size as the live image
-        mask = np.zeros([self.H, self.W])
-
-        # Convert the live image to grayscale
-        image = cv2.cvtColor(self.image_live, cv2.COLOR_BGR2GRAY)
-
-        # Apply the mask to the live image (copy)
-        image_m = np.copy(self.image_live)
-        image_m[mask == 0] = 0
+        # Keep the charts of the last processed frame if nothing changed
+        if self.processor.metrics["reused"]:
+            self.processor.change_detector.skipped["chart"] += 1
+            return
 
-        # Calculate image moments and centroid coordinates
-        MOM = cv2.moments(image)
-        centroid_x = int(MOM["m10"] / MOM["m00"])
-        centroid_y = int(MOM["m01"] / MOM["m00"])
-
-        # Extract x and y profiles centered at the centroid
-        x_prof = image[round(centroid_y), :]
-        y_prof = image[:, round(centroid_x)]
-
-        # Fit Gaussian to the x and y profiles
-        popt_x = fit_gaussian(x_prof)
-        popt_y = fit_gaussian(y_prof)
-        fitted_x = gaussian(np.arange(len(x_prof)), *popt_x)
-        fitted_y = gaussian(np.arange(len(y_prof)), *popt_y)
+        # Profiles and Gaussian fits of the frame analysed by beam()
+        x_prof, y_prof, fitted_x, fitted_y = self.processor.profiles
 
         # Update the live charts with new data
         self.update_chart(self.MainWindow.live_chart_x, x_prof, fitted_x)
@@ -550,67 +564,9 @@ class captureThread(QThread):
 
     # initialize camera settings
     def init_camera(self):
-        # Get the selected resolution from the comboBox and set camera width and height
-        resolution = self.MainWindow.comboBox_resolution.currentText().split("x")
-        self.W, self.H = int(resolution[0]), int(resolution[1])
-
-        # Initialize the PiCamera and set the resolution
-        camera = PiCamera()
-        camera.resolution = (self.W, self.H)
-        rawCapture = PiRGBArray(camera, size=(self.W, self.H))
-
-        # Allow camera to warm up
-        time.sleep(0.1)
-
-        # Set camera settings based on MainWindow inputs
-        camera.awb_mode = self.MainWindow.comboBox_awb.currentText()
-        r_gain = float(self.MainWindow.lineEdit_awb_gains_r.text())
-        b_gain = float(self.MainWindow.lineEdit_awb_gains_b.text())
-        camera.awb_gains = (r_gain, b_gain)
-        camera.brightness = int(self.MainWindow.lineEdit_brightness.text())
-        camera.meter_mode = self.MainWindow.comboBox_meter_mode.currentText()
-        camera.exposure_mode = self.MainWindow.comboBox_exposure_mode.currentText()
-        camera.exposure_compensation = int(
-            self.MainWindow.lineEdit_exposure_comp.text()
-        )
-        camera.shutter_speed = int(self.MainWindow.lineEdit_shutter.text())
-        camera.vflip = True
-        camera.hflip = False
-        camera.iso = int(self.MainWindow.lineEdit_iso.text())
-        camera.saturation = int(self.MainWindow.lineEdit_saturation.text())
-
-        # Optional settings for zoom and framerate
-        ZOOM_BOOL = False
-        if ZOOM_BOOL:
-            crop_factor = 0.4
-            roi_start_x = (1 - crop_factor) / 2
-            roi_start_y = (1 - crop_factor) / 2
-            camera.zoom = (roi_start_x, roi_start_y, crop_factor, crop_factor)
-
-        # Print camera settings if desired
-        CAMERA_SETTINGS = True
-        if CAMERA_SETTINGS:
-            print("AWB is " + str(camera.awb_mode))
-            print("AWB gain is " + str(camera.awb_gains))
-            print("Brightness is " + str(camera.brightness))
-            print("Aperture is " + str(camera.exposure_compensation))
-            print("Shutter speed is " + str(camera.shutter_speed))
-            print("Camera exposure speed is " + str(camera.exposure_speed))
-            print("Iso is " + str(camera.iso))
-            print("Camera digital gain is " + str(camera.digital_gain))
-            print("Camera analog gain is " + str(camera.analog_gain))
-            print("Camera v/h flip is " + str(camera.vflip) + ", " + str(camera.hflip))
-            print("Camera contrast is " + str(camera.contrast))
-            print("Camera color saturation is " + str(camera.saturation))
-            print("Camera meter mode is " + str(camera.meter_mode))
-            # print("framerate "+str(camera.framerate))
-            if ZOOM_BOOL:
-                print("Camera crop factor is " + str(crop_factor))
-            else:
-                print("Camera crop is disabled")
-        # Assign camera and rawCapture to the instance
-        self.camera = camera
-        self.rawCapture = rawCapture
+        # Open the PiCamera with the camera settings entered in the MainWindow
+        self.daemon.start(thread=False)
+        self.W, self.H = self.daemon.settings.resolution
 
         # Update the GUI with a status message
         self.MainWindow.lineEdit.setText(
@@ -618,51 +574,71 @@ class captureThread(QThread):
         )
 
         # Update the GUI with the actual camera settings
-        self.MainWindow.lineEdit_shutter.setText(str(self.camera.shutter_speed))
-        self.MainWindow.lineEdit_frame.setText(str(camera.framerate))
-        self.MainWindow.lineEdit_brightness.setText(str(camera.brightness))
-        self.MainWindow.lineEdit_exposure_comp.setText(
-            str(camera.exposure_compensation)
-        )
-        self.MainWindow.lineEdit_iso.setText(str(camera.iso))
-        self.MainWindow.lineEdit_saturation.setText(str(camera.saturation))
-
-    # Stop the camera and update the GUI with a status message
-    def stop_camera(self):
-        if self.camera:
-            self.camera.close()
-            self.MainWindow.lineEdit.setText("Camera stopped & settings applied")
-
-    # Capture an image from the camera and store it to self.image_live
-    def img_capture(self):
-        self.camera.capture(self.rawCapture, format="bgr")
-        self.image_live = self.rawCapture.array
-        self.rawCapture.truncate(0)
-
-    # Take camera capture and display live on "Camera" tab
+        self.MainWindow.show_camera_readback(self.daemon.source.readback())
+
+    # Show the outcome of settings applied by the daemon before the latest frame, and the
+    # shutter speed chosen by auto exposure
+    def show_settings(self):
+        daemon = self.daemon
+        if daemon.reconfigured is not None:
+            if daemon.mailbox.error is not None:
+                # the camera kept its previous settings
+                self.MainWindow.lineEdit.setText("Settings not applied: " + daemon.mailbox.error)
+            else:
+                ms, resized = daemon.reconfigured
+                if resized:
+                    # resize the image frames for the new resolution
+                    self.W, self.H = daemon.source.settings.resolution
+                    self.FRAMES_INIT = False
+                self.MainWindow.show_camera_readback(daemon.source.readback())
+                self.MainWindow.lineEdit.setText(
+                    "Settings applied in {:.0f} ms".format(ms)
+                    + (" (resolution changed)" if resized else "")
+                )
+        shutter = str(daemon.settings.shutter_speed)
+        if daemon.exposure.enabled and self.MainWindow.lineEdit_shutter.text() != shutter:
+            self.MainWindow.lineEdit_shutter.setText(shutter)
+
+    # Enable frame-change detection when "Skip unchanged" is checked. A detector enabled
+    # again starts without a reference, so it never compares with a frame from before
+    def change_detection(self):
+        enabled = self.MainWindow.checkBox_skip_unchanged.isChecked()
+        threshold = None
+        if enabled:
+            try:
+                threshold = float(self.MainWindow.lineEdit_change_threshold.text())
+            except ValueError:
+                pass
+        self.daemon.set_change_detection(enabled, threshold)
+
+    # Adjust the shutter speed from the beam histogram when "Auto exposure" is checked
+    def auto_exposure(self):
+        enabled = self.MainWindow.checkBox_auto_exposure.isChecked()
+        if enabled != self.daemon.exposure.enabled:
+            self.daemon.set_auto_exposure(enabled)
+
+    # Pass the text entered for saved data to the processor before it saves
+    def save_options(self):
+        processor = self.processor
+        if processor.SAVE_NOW:
+            processor.save_prefix = self.MainWindow.lineEdit_savePrefix.text()
+            processor.notes = self.MainWindow.plainTextEdit_smallText.toPlainText()
+            processor.frame_codec = self.MainWindow.comboBox_codec.currentText()
+            processor.data_format = self.MainWindow.comboBox_data_format.currentText()
+            processor.save_plots = self.MainWindow.checkBox_plots.isChecked()
+
+    # Display the captured frame live on the "Camera" tab
     def live_image(self):
         # Time printouts can be used for runtime optimization which directly translates to framerate of images
         # A = datetime.datetime.now()
 
-        # Capture an image
-        self.img_capture()
-
         # Determine the scale factor based on the camera resolution
-        if self.W == 640 and self.H == 480:
-            scale = 1
-        elif self.W == 1280 and self.H == 720:
-            scale = 2
-        elif self.W == 1920 and self.H == 1080:
-            scale = 3
-        elif self.W == 2560 and self.H == 1440:
-            scale = 4
-        elif self.W == 4056 and self.H == 3040:
-            scale = 6
-        else:
-            scale = 1
+        scale = display_scale(self.W, self.H)
 
-        # Resize the image to fit the GUI screen
-        imR = cv2.resize(self.image_live, (int(self.W / scale), int(self.H / scale)))
+        # Resize the image to fit the GUI screen (into reused display buffers)
+        pool = self.processor.pool
+        size = (int(self.W / scale), int(self.H / scale))
+        imR = cv2.resize(self.image_live, size, dst=pool.buffer("display_live", (size[1], size[0], 3)))
 
         # Set the image frame to the proper position and size on the window, if not already done
         if not self.FRAMES_INIT:
@@ -670,7 +646,7 @@ class captureThread(QThread):
             self.MainWindow.image_frame.resize(int(self.W / scale), int(self.H / scale))
 
         # Convert the image from BGR to RGB format
-        imBGR2RGB = cv2.cvtColor(imR, cv2.COLOR_BGR2RGB)
+        imBGR2RGB = cv2.cvtColor(imR, cv2.COLOR_BGR2RGB, dst=pool.buffer("display_live_rgb", imR.shape))
 
         # Create a QImage to be displayed in the GUI
         imGUI = QtGui.QImage(
@@ -688,36 +664,17 @@ class captureThread(QThread):
         # print("Live image runtime: "+str(B-A))
 
 # Convert camera image to beam profile (rainbow map) and display on GUI
-# Compute metrics of the beam (centroid, D4σ)
+# Show the metrics of the beam (centroid, D4σ) computed by the daemon
     def beam(self):
         # Time printouts can be used for runtime optimization which directly translates to framerate of images
         # A = datetime.datetime.now()
 
-        # Convert the live image to grayscale for intensity profiling
-        image = cv2.cvtColor(self.image_live, cv2.COLOR_BGR2GRAY)
-
-        # Compute the centroid and D4σ in pixel values if the image is not empty
-        MOM = cv2.moments(image)
-        if MOM["m00"] != 0:
-            centroid_x = MOM["m10"] / MOM["m00"]
-            centroid_y = MOM["m01"] / MOM["m00"]
-
-            # Calculate the D4σ in physical units (using pixel size in microns)
-            d4x = (
-                self.pixel_um
-                * 4
-                * math.sqrt(abs(MOM["m20"] / MOM["m00"] - centroid_x**2))
-            )
-            d4y = (
-                self.pixel_um
-                * 4
-                * math.sqrt(abs(MOM["m02"] / MOM["m00"] - centroid_y**2))
-            )
-        else:
-            centroid_x = self.mask_x
-            centroid_y = self.mask_y
-            d4x = 0
-            d4y = 0
+        # Centroid, D4σ and profile fits of the latest frame (saved by the daemon with
+        # the frame if the SAVE_NOW flag was set)
+        processor = self.processor
+        metrics = processor.metrics
+        centroid_x, centroid_y = metrics["centroid_x"], metrics["centroid_y"]
+        d4x, d4y = metrics["d4x"], metrics["d4y"]
 
         # Update the GUI with centroid and D4σ values
         self.MainWindow.label_centroid.setText(
@@ -725,106 +682,31 @@ class captureThread(QThread):
         )
         self.MainWindow.lcdNumber_dx.display(round(d4x))
         self.MainWindow.lcdNumber_dy.display(round(d4y))
+        if metrics["saturated_pixels"] > 0:
+            self.MainWindow.label_saturated.setText(
+                "Saturated: " + str(metrics["saturated_pixels"]) + " px, D4σ/fit unreliable"
+            )
+        else:
+            self.MainWindow.label_saturated.setText("")
 
-        # Invert the grayscale image and apply the rainbow colormap
-        dark_pixel_threshold = 0
-        num_dark_pixels = np.sum(image <= dark_pixel_threshold)
-        image_n = 255 - image
-        beam = cv2.applyColorMap(image_n, cv2.COLORMAP_RAINBOW)
-
-        # Save all data if the SAVE_NOW flag is set by the save button, then reset the flag
-        if self.SAVE_NOW:
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            save_prefix = self.MainWindow.lineEdit_savePrefix.text()
-            filename6 = save_prefix + "_entered_info_" + timestamp + ".txt"
-            savepath = os.path.join(os.getcwd(), "saves" + timestamp)
-
-            # If the savepath directory doesn't exist, create it
-            if not os.path.exists(savepath):
-                os.mkdir(savepath)
-
-            # Define filenames for different types of data to be saved
-            filename1 = save_prefix + "camera_" + timestamp + ".png"
-            filename2 = save_prefix + "beam_" + timestamp + ".png"
-            filename3 = save_prefix + "stats_" + timestamp + ".csv"
-            filename4 = save_prefix + "x_profile_" + timestamp + ".png"
-            filename5 = save_prefix + "y_profile_" + timestamp + ".png"
-
-            # Save the live image and beam profile as PNG images
-            cv2.imwrite(os.path.join(savepath, filename1), self.image_live)
-            cv2.imwrite(os.path.join(savepath, filename2), beam)
-
-            # Create and write statistics to a CSV file
-            statsfile = open(os.path.join(savepath, filename3), "w")
-            statsfile.write("Image width (px), height (px)\n")
-            statsfile.write(str(self.W) + "," + str(self.H) + "\n")
-            statsfile.write("Centroid x (px), y (px)\n")
-            statsfile.write(str(centroid_x) + "," + str(centroid_y) + "\n")
-            statsfile.write("D4σ x, y\n")
-            statsfile.write(str(d4x) + "," + str(d4y) + "\n")
-            max_pixel = np.amax(image)
-            min_pixel = np.amin(image)
-            statsfile.write("Number of dark pixels (threshold: {})\n".format(dark_pixel_threshold))
-            statsfile.write(str(num_dark_pixels) + "\n")
-            total_pixel_counts = np.sum(image)
-            average_pixel_count = np.mean(image)
-            statsfile.write("Max pixel value\n")
-            statsfile.write(str(max_pixel) + "\n")
-            statsfile.write("Min pixel value\n")
-            statsfile.write(str(min_pixel) + "\n")
-            statsfile.write("Total pixel counts\n")
-            statsfile.write(str(total_pixel_counts) + "\n")
-            statsfile.write("Average pixel count\n")
-            statsfile.write(str(average_pixel_count) + "\n")
-            statsfile.close()
-
-            # Save additional information entered by the user in a text file
-            with open(os.path.join(savepath, filename6), "w") as small_text_file:
-                small_text_file.write(self.MainWindow.plainTextEdit_smallText.toPlainText())
-
-            # Generate and save x-axis and y-axis beam profiles as PNG images
-            x_prof = image[round(centroid_y), :]
-            plt.plot(range(len(x_prof)), x_prof)
-            plt.title("Beam profile along x-axis at y-centroid")
-            plt.xlim(0, len(x_prof) - 1)
-            plt.ylim(0, 255)
-            plt.xlabel("Pixel")
-            plt.ylabel("Intensity")
-            plt.savefig(os.path.join(savepath, filename4))
-            plt.close("all")
-
-            y_prof = image[:, round(centroid_x)]
-            plt.plot(range(len(y_prof)), y_prof)
-            plt.title("Beam profile along y-axis at x-centroid")
-            plt.xlim(0, len(y_prof) - 1)
-            plt.ylim(0, 255)
-            plt.xlabel("Pixel")
-            plt.ylabel("Intensity")
-            plt.savefig(os.path.join(savepath, filename5))
-            plt.close("all")
-
-            # Save pixel intensity data in a text file
-            output_file = "pixel_data.txt"
-            # Open the output file for writing pixel intensity data
-            with open(os.path.join(savepath, output_file), "w") as f:
-                # Write the header for the output file
-                f.write("{:<10}{:<25}{:<25}\n".format("Pixel #", "X-axis Intensity Value", "Y-axis Intensity Value"))
-
-                # Iterate through the pixel intensities and write them to the output file
-                num_pixels = max(len(x_prof), len(y_prof))
-                for i in range(num_pixels):
-                    x_intensity = x_prof[i] if i < len(x_prof) else ""
-                    y_intensity = y_prof[i] if i < len(y_prof) else ""
-                    f.write("{:<10}{:<25}{:<25}\n".format(i, x_intensity, y_intensity))
-
-            # Update the GUI's info bar depending on the logging status
-            if not self.LOGGING:
-                self.MainWindow.lineEdit.setText("Data saved to: " + savepath)
-                self.SAVE_NOW = False
+        # Update the GUI's info bar depending on the logging status
+        if processor.saved_to is not None:
+            size = " (frame {}, {:.0f} kB in {:.0f} ms)".format(
+                processor.last_save["seq"], processor.last_save["bytes"] / 1000, processor.last_save["ms"]
+            )
+            if not processor.LOGGING:
+                self.MainWindow.lineEdit.setText("Data saved to: " + processor.saved_to + size)
             else:
-                self.MainWindow.lineEdit.setText("Data logging to: " + savepath)
+                self.MainWindow.lineEdit.setText("Data logging to: " + processor.saved_to + size)
+
+        # Nothing changed since the last processed frame: keep the displayed beam image
+        if metrics["reused"]:
+            processor.change_detector.skipped["display"] += 1
+            return
+
+        # Inverted grayscale image with the rainbow colormap
+        beam = processor.colormap()
 
-        
         # Round the centroid and D4σ values to integers
         d4x, d4y, centroid_x, centroid_y = round(d4x), round(d4y), round(centroid_x), round(centroid_y)
 
@@ -833,25 +715,16 @@ class captureThread(QThread):
         cv2.line(beam, (0, centroid_y), (self.W, centroid_y), (0, 0, 0), thickness=5)
 
         # Determine the scale factor for downsampling the image to fit on the GUI screen
-        if self.W == 640 and self.H == 480:
-            scale = 1
-        elif self.W == 1280 and self.H == 720:
-            scale = 2
-        elif self.W == 1920 and self.H == 1080:
-            scale = 3
-        elif self.W == 2560 and self.H == 1440:
-            scale = 4
-        elif self.W == 4056 and self.H == 3040:
-            scale = 6
-        else:
-            scale = 1
+        scale = display_scale(self.W, self.H)
 
         # Resize the beam profile image according to the scale factor
-        beam_R = cv2.resize(beam, (int(self.W / scale), int(self.H / scale)))
-        beam_R = cv2.cvtColor(beam_R, cv2.COLOR_BGR2RGB)
+        pool = processor.pool
+        size = (int(self.W / scale), int(self.H / scale))
+        beam_R = cv2.resize(beam, size, dst=pool.buffer("display_beam", (size[1], size[0], 3)))
+        beam_R = cv2.cvtColor(beam_R, cv2.COLOR_BGR2RGB, dst=pool.buffer("display_beam_rgb", beam_R.shape))
 
         # Draw the aperture mask circle on the resized beam profile image
-        beam_R = cv2.circle(beam_R, (round(self.mask_x / scale), round(self.mask_y / scale)), int(self.mask_r / scale), (0, 0, 0), 2)
+        beam_R = cv2.circle(beam_R, (round(processor.mask_x / scale), round(processor.mask_y / scale)), int(processor.mask_r / scale), (0, 0, 0), 2)
 
         # Set the image to the proper position on the window if not already done
         if not self.FRAMES_INIT:
@@ -868,9 +741,39 @@ class captureThread(QThread):
 
 if __name__ == "__main__":
     import sys
-    app = QtWidgets.QApplication(sys.argv)
+    import argparse
+
+    # command line options; anything not recognised here is passed on to Qt
+    parser = argparse.ArgumentParser(description="Raspberry Pi laser beam profiler")
+    parser.add_argument("--serve", action="store_true", help="publish metrics and previews to remote dashboards")
+    parser.add_argument("--serve-host", default="127.0.0.1", help="address for the streaming server")
+    parser.add_argument("--serve-port", type=int, default=8765, help="HTTP port (WebSocket metrics, MJPEG preview)")
+    parser.add_argument("--binary-port", type=int, default=None, help="optional port for length-prefixed binary metrics")
+    parser.add_argument("--preview-every", type=int, default=5, help="send every Nth frame as MJPEG preview")
+    parser.add_argument("--memory-cap", type=float, default=None, help="memory budget for the frame buffers in MB")
+    args, qt_args = parser.parse_known_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     MainWindow = QtWidgets.QMainWindow()
     ui = Ui_MainWindow()
     ui.setupUi(MainWindow)
+    ui.memory_cap_mb = args.memory_cap
+    if args.serve:
+        from BeamServer import BeamStreamServer
+
+        ui.server = BeamStreamServer(
+            host=args.serve_host,
+            port=args.serve_port,
+            binary_port=args.binary_port,
+            preview_every=args.preview_every,
+        ).start()
+        ui.lineEdit.setText("Streaming server on http://" + args.serve_host + ":" + str(ui.server.port))
     MainWindow.show()
-    sys.exit(app.exec_())
+    status = app.exec_()
+    if ui.RUNNING:
+        # the thread stops the daemon, which closes the camera and commits the save index
+        ui.threadA.stop()
+        ui.threadA.wait()
+    if ui.server is not None:
+        ui.server.stop()
+    sys.exit(status)
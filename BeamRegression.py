@@ -0,0 +1,284 @@
+# Vyir
+# Vyirtech.com
+
+# Replay-and-compare regression harness. Replays a recorded frame corpus through the
+# current beam analysis (BeamProcessor.analyze + fit_profiles) and a candidate analysis
+# side by side on all cores, and reports the differences in centroid, D4σ and Gaussian
+# fit σ/FWHM against tolerances together with the speedup of the candidate.
+# Run e.g. `python BeamRegression.py compare recordings --candidate my_fit:analyze`;
+# it exits with status 1 if a metric is out of tolerance (or the candidate is too slow).
+# `python BeamRegression.py record corpus --frames 200` records a corpus from a camera.
+
+# required imports
+import os
+import sys
+import time
+import json
+import importlib
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from BeamCore import BeamProcessor, CameraSettings, full_width_half_maximum, make_source
+from BeamStorage import INDEX_NAME, BeamIndex, read_frame
+
+# file types read from a plain corpus directory
+FRAME_EXTENSIONS = (".npy", ".png", ".tif", ".tiff")
+
+# compared metrics and their default absolute tolerances (pixels, D4σ in μm). The
+# candidate's reported FWHM is compared with full_width_half_maximum() of the current σ
+TOLERANCES = {
+    "centroid_x": 0.01,
+    "centroid_y": 0.01,
+    "d4x": 0.05,
+    "d4y": 0.05,
+    "fit_x_sigma": 0.01,
+    "fit_y_sigma": 0.01,
+    "fit_x_fwhm": float(full_width_half_maximum(0.01)),
+    "fit_y_fwhm": float(full_width_half_maximum(0.01)),
+}
+
+# analyses loaded and processors created in this (worker) process, by candidate spec
+_analyses = {}
+_processors = {}
+
+
+# The current analysis: centroid and D4σ from the moments, Gaussian fits of the profiles
+def reference_analysis(image_live):
+    processor = _processors.get(None)
+    if processor is None:
+        processor = _processors[None] = BeamProcessor()
+    processor.analyze(image_live)
+    processor.fit_profiles()
+    return dict(processor.metrics)
+
+
+# Analysis function for a "module:name" spec (None: the current analysis). `name` is either
+# a function taking a BGR frame and returning a metrics dict with the BeamProcessor keys,
+# or a BeamProcessor subclass whose analyze() and fit_profiles() are run
+def load_analysis(spec):
+    if spec is None:
+        return reference_analysis
+    module_name, _, name = spec.partition(":")
+    target = getattr(importlib.import_module(module_name), name or "analyze")
+    if not isinstance(target, type):
+        return target
+    processor = target()
+
+    def analysis(image_live):
+        processor.analyze(image_live)
+        processor.fit_profiles()
+        return dict(processor.metrics)
+
+    return analysis
+
+
+# Frames of a corpus as (root, file entry) pairs which read_frame() loads. A corpus is a
+# save root with a frame index (the `kind` frames of every indexed save) or a directory
+# of .npy/.png/.tiff frames (matched by name prefix `kind` if any file has it)
+def corpus_items(path, kind="camera", limit=None):
+    if os.path.isfile(os.path.join(path, INDEX_NAME)):
+        index = BeamIndex(path)
+        rows = index.query()
+        index.close()
+        items = [(path, entry) for row in rows for entry in row["files"] if entry["kind"] == kind]
+    else:
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(FRAME_EXTENSIONS))
+        if any(name.startswith(kind) for name in names):
+            names = [name for name in names if name.startswith(kind)]
+        items = [(path, {"path": name, "dtype": None}) for name in names]
+    if not items:
+        raise ValueError("No frames found in " + path)
+    return items[:limit] if limit is not None else items
+
+
+# BGR frame of a corpus item
+def load_frame(item):
+    image_live = read_frame(*item)
+    if image_live.ndim == 2:
+        image_live = np.repeat(image_live[:, :, None], 3, axis=2)
+    return image_live
+
+
+# Worker initializer: load the candidate and run both analyses once untimed, so creating
+# the processors, allocating their buffers and the first scipy call are not timed
+def warm_up(candidate, item):
+    _analyses[candidate] = load_analysis(candidate)
+    image_live = load_frame(item)
+    reference_analysis(image_live)
+    _analyses[candidate](image_live)
+
+
+# Run both analyses on one frame (in a worker process). The order alternates from frame
+# to frame so neither analysis always runs with warm caches; each timing is the median of
+# `repeat` runs. Returns (reference metrics, candidate metrics, reference s, candidate s)
+def compare_frame(job):
+    n, item, candidate, repeat = job
+    image_live = load_frame(item)
+    analyses = [reference_analysis, _analyses[candidate]]
+    results, seconds = [None, None], [[], []]
+    for i in ((0, 1) if n % 2 == 0 else (1, 0)):
+        for _ in range(repeat):
+            A = time.perf_counter()
+            results[i] = analyses[i](image_live)
+            seconds[i].append(time.perf_counter() - A)
+    return results[0], results[1], statistics.median(seconds[0]), statistics.median(seconds[1])
+
+
+# Compared metrics of one analysis result. With derive_fwhm (the current analysis) FWHM
+# is derived from the fitted σ, otherwise the reported fit_*_fwhm is compared
+def compared_metrics(metrics, derive_fwhm=False):
+    values = {}
+    for name in TOLERANCES:
+        if name.endswith("_fwhm") and derive_fwhm:
+            sigma = metrics.get(name[:-4] + "sigma", np.nan)
+            values[name] = float(full_width_half_maximum(abs(sigma)))
+        else:
+            values[name] = float(metrics.get(name, np.nan))
+    return values
+
+
+# Replay the corpus through the current and the candidate analysis and compare them.
+# Returns a report with per-metric differences, failures and timings
+def compare(items, candidate=None, tolerances=None, rtol=0.0, workers=None, repeat=5):
+    tolerances = dict(TOLERANCES, **(tolerances or {}))
+    workers = workers or os.cpu_count() or 1
+    jobs = [(n, item, candidate, repeat) for n, item in enumerate(items)]
+    A = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up, initargs=(candidate, items[0])) as executor:
+        results = list(executor.map(compare_frame, jobs, chunksize=max(1, len(jobs) // (8 * workers))))
+    wall = time.perf_counter() - A
+    references = [compared_metrics(result[0], derive_fwhm=True) for result in results]
+    candidates = [compared_metrics(result[1]) for result in results]
+
+    metrics = {}
+    for name, tolerance in tolerances.items():
+        reference = np.array([values[name] for values in references])
+        candidate_values = np.array([values[name] for values in candidates])
+        difference = np.abs(candidate_values - reference)
+        # NaN on both sides (fit failed on both) counts as equal, NaN on one side as a mismatch
+        both_nan = np.isnan(reference) & np.isnan(candidate_values)
+        difference[both_nan] = 0.0
+        difference[np.isnan(difference)] = np.inf
+        failed = difference > tolerance + rtol * np.abs(np.nan_to_num(reference))
+        worst = int(np.argmax(difference)) if len(difference) else 0
+        metrics[name] = {
+            "tolerance": tolerance,
+            "max_difference": float(difference.max()) if len(difference) else 0.0,
+            "mean_difference": (
+                float(difference[np.isfinite(difference)].mean()) if np.isfinite(difference).any() else 0.0
+            ),
+            "worst_frame": items[worst][1]["path"],
+            "failed": int(failed.sum()),
+        }
+
+    reference_s = sum(result[2] for result in results)
+    candidate_s = sum(result[3] for result in results)
+    return {
+        "frames": len(results),
+        "candidate": candidate or "current",
+        "metrics": metrics,
+        "equivalent": all(metric["failed"] == 0 for metric in metrics.values()),
+        "reference_ms": 1000.0 * reference_s / len(results),
+        "candidate_ms": 1000.0 * candidate_s / len(results),
+        "speedup": reference_s / candidate_s if candidate_s > 0 else float("inf"),
+        "wall_s": wall,
+        "workers": workers,
+    }
+
+
+# Record `frames` camera frames as .npy files into `path`, cycling through the given
+# shutter speeds (μs) so the corpus covers dim, well-exposed and saturated beams
+def record_corpus(path, spec="sim", frames=100, resolution=(640, 480), shutters=None):
+    os.makedirs(path, exist_ok=True)
+    settings = CameraSettings(resolution=resolution)
+    source = make_source(spec, settings)
+    source.open()
+    try:
+        for n in range(frames):
+            if shutters:
+                source.reconfigure(source.settings.copy().update(shutter_speed=shutters[n % len(shutters)]))
+            np.save(os.path.join(path, "camera_{:06d}.npy".format(n)), source.capture())
+    finally:
+        source.close()
+    return frames
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare a candidate beam analysis with the current one on recorded frames")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("compare", help="replay a corpus through both analyses and compare the metrics")
+    run.add_argument("corpus", help="save root with " + INDEX_NAME + " or a directory of .npy/.png/.tiff frames")
+    run.add_argument("--candidate", default=None, help="module:function or module:BeamProcessorSubclass (default: the current analysis)")
+    run.add_argument("--kind", default="camera", help="saved frame kind (or file name prefix) to replay")
+    run.add_argument("--limit", type=int, default=None, help="replay at most this many frames")
+    run.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    run.add_argument("--repeat", type=int, default=5, help="time each analysis as the median of N runs per frame")
+    run.add_argument("--tol", action="append", default=[], metavar="METRIC=VALUE", help="override a tolerance, e.g. d4x=0.1")
+    run.add_argument("--rtol", type=float, default=0.0, help="relative tolerance added to the absolute ones")
+    run.add_argument("--min-speedup", type=float, default=None, help="also fail if the candidate is not this much faster")
+    run.add_argument("--json", default=None, help="write the full report to this file")
+
+    record = commands.add_parser("record", help="record a frame corpus from a camera source")
+    record.add_argument("corpus", help="directory for the recorded frames")
+    record.add_argument("--source", default="sim", help="camera source: pi, usb:<n>, cv:<path> or sim[:<seed>]")
+    record.add_argument("--frames", type=int, default=100)
+    record.add_argument("--resolution", default="640x480")
+    record.add_argument("--shutter", type=int, action="append", help="shutter speed to cycle through (repeatable)")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        resolution = CameraSettings(resolution=args.resolution).resolution
+        record_corpus(args.corpus, args.source, args.frames, resolution, args.shutter)
+        print("Recorded " + str(args.frames) + " frames to " + args.corpus)
+        sys.exit(0)
+
+    tolerances = {}
+    for override in args.tol:
+        name, _, value = override.partition("=")
+        if name not in TOLERANCES:
+            parser.error("unknown metric " + name + ", choose from " + ", ".join(TOLERANCES))
+        tolerances[name] = float(value)
+
+    # candidate modules are imported from the current directory as well
+    sys.path.insert(0, os.getcwd())
+    report = compare(
+        corpus_items(args.corpus, args.kind, args.limit),
+        args.candidate,
+        tolerances,
+        args.rtol,
+        args.workers,
+        args.repeat,
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print("{} frames, candidate {}".format(report["frames"], report["candidate"]))
+    print("{:>14}{:>12}{:>14}{:>14}{:>8}".format("metric", "tolerance", "max diff", "mean diff", "failed"))
+    for name, metric in report["metrics"].items():
+        print(
+            "{:>14}{:>12.4g}{:>14.4g}{:>14.4g}{:>8}".format(
+                name, metric["tolerance"], metric["max_difference"], metric["mean_difference"], metric["failed"]
+            )
+            + ("  worst: " + metric["worst_frame"] if metric["failed"] else "")
+        )
+    print(
+        "current {:.2f} ms/frame, candidate {:.2f} ms/frame, speedup {:.2f}x ({:.1f} s, {} worker processes)".format(
+            report["reference_ms"],
+            report["candidate_ms"],
+            report["speedup"],
+            report["wall_s"],
+            report["workers"],
+        )
+    )
+    fast_enough = args.min_speedup is None or report["speedup"] >= args.min_speedup
+    print(
+        ("EQUIVALENT" if report["equivalent"] else "NOT EQUIVALENT")
+        + ("" if fast_enough else ", speedup below {:.2f}x".format(args.min_speedup))
+    )
+    sys.exit(0 if report["equivalent"] and fast_enough else 1)
@@ -0,0 +1,398 @@
+# Vyir
+# Vyirtech.com
+
+# Optional streaming server which publishes live beam metrics and preview frames
+# to remote dashboards. The server runs its own asyncio event loop in a background
+# thread, so the capture loop only hands over the latest frame and never waits on
+# the network.
+#
+# Endpoints (HTTP port):
+#   GET /metrics      WebSocket (RFC 6455) stream of per-frame JSON metrics
+#   GET /stream.mjpg  multipart MJPEG stream of decimated preview frames
+#   GET /latest       JSON of the most recent metrics
+# Optional binary port: stream of length-prefixed JSON metrics
+#   (4-byte big-endian payload length followed by the UTF-8 JSON payload)
+
+# required imports
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+
+import cv2
+
+# GUID appended to the client key during the WebSocket handshake
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# boundary string separating JPEG parts in the MJPEG stream
+MJPEG_BOUNDARY = "beamframe"
+# largest client-to-server WebSocket frame accepted (clients only send control frames)
+WS_MAX_CLIENT_FRAME = 65536
+
+
+# Convert numpy scalars/arrays so metrics can be serialized to JSON
+def json_default(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+# Build an unmasked server-to-client WebSocket frame (text opcode by default)
+def websocket_frame(payload, opcode=0x1):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    return header + payload
+
+
+# Encode a preview frame as a single MJPEG multipart chunk
+def mjpeg_part(frame, quality):
+    ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return None
+    jpeg = jpeg.tobytes()
+    header = (
+        "--" + MJPEG_BOUNDARY + "\r\n"
+        "Content-Type: image/jpeg\r\n"
+        "Content-Length: " + str(len(jpeg)) + "\r\n\r\n"
+    ).encode("ascii")
+    return header + jpeg + b"\r\n"
+
+
+# Connection state for one remote client. Each client owns a small bounded queue;
+# when a client falls behind, its oldest message is dropped instead of blocking
+# the broadcaster or any other client
+class StreamClient:
+    def __init__(self, writer, kind, queue_size):
+        self.writer = writer
+        self.kind = kind  # "ws", "mjpeg" or "binary"
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False  # no further messages are queued once closing
+        self.task = asyncio.current_task()
+
+    # Queue a message without waiting, dropping the oldest queued message if full
+    def offer(self, message):
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    # End the stream: with discard=True unsent messages are dropped (e.g. after a
+    # WebSocket Close, when no more data frames may be sent), otherwise they are sent first
+    def close(self, discard=False):
+        if self.closed:
+            return
+        if discard:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        elif self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(None)
+        self.closed = True
+
+
+# Streaming server shared by all clients. publish() is called from the capture
+# thread; each frame is encoded once and the encoded bytes are fanned out to all clients
+class BeamStreamServer:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8765,
+        binary_port=None,
+        preview_every=5,
+        preview_width=320,
+        jpeg_quality=70,
+        queue_size=2,
+    ):
+        self.host = host
+        self.port = port  # use 0 to pick a free port (e.g. for localhost tests)
+        self.binary_port = binary_port
+        self.preview_every = max(1, int(preview_every))  # send every Nth frame as preview
+        self.preview_width = preview_width
+        self.jpeg_quality = jpeg_quality
+        self.queue_size = queue_size
+
+        self.loop = None
+        self.clients = set()
+        self.latest_metrics = None
+        # counters reported by stats()
+        self.published = 0  # frames handed over by the capture thread
+        self.broadcast = 0  # frames encoded and fanned out
+        self.superseded = 0  # frames replaced before the server got to them
+
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = None  # latest (metrics, preview) not yet broadcast
+        self._ready = threading.Event()
+        self._error = None
+        self._wakeup = None
+        self._stopping = None
+
+    # Start the event loop thread and wait until the sockets are listening
+    def start(self):
+        self._thread = threading.Thread(target=self._run_loop, name="BeamStreamServer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    # Stop the server, disconnect all clients and join the loop thread
+    def stop(self):
+        if self.loop is not None and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join()
+        self.loop = None
+
+    # Hand over the latest metrics (and optionally the live frame) from the capture thread.
+    # Never blocks: if the server has not sent the previous frame yet, it is replaced
+    def publish(self, metrics, frame=None):
+        loop = self.loop
+        if loop is None or self._stopping is None:
+            return
+        preview = None
+        if (
+            frame is not None
+            and self.published % self.preview_every == 0
+            and any(client.kind == "mjpeg" for client in list(self.clients))
+        ):
+            h, w = frame.shape[:2]
+            pw = min(self.preview_width, w)
+            preview = cv2.resize(frame, (pw, max(1, round(h * pw / w))), interpolation=cv2.INTER_AREA)
+        self.published += 1
+
+        with self._lock:
+            if self._pending is not None:
+                self.superseded += 1
+                # keep the pending preview if this frame does not carry a new one
+                if preview is None:
+                    preview = self._pending[1]
+            self._pending = (dict(metrics), preview)
+        try:
+            loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # loop already closed by stop()
+            pass
+
+    # Snapshot of server counters and per-client delivery statistics
+    def stats(self):
+        return {
+            "published": self.published,
+            "broadcast": self.broadcast,
+            "superseded": self.superseded,
+            "clients": [
+                {"kind": client.kind, "sent": client.sent, "dropped": client.dropped}
+                for client in list(self.clients)
+            ],
+        }
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+
+    async def _serve(self):
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        servers = []
+        try:
+            servers.append(await asyncio.start_server(self._handle_http, self.host, self.port))
+            self.port = servers[0].sockets[0].getsockname()[1]
+            if self.binary_port is not None:
+                servers.append(
+                    await asyncio.start_server(self._handle_binary, self.host, self.binary_port)
+                )
+                self.binary_port = servers[1].sockets[0].getsockname()[1]
+        except OSError as e:
+            self._error = e
+            for server in servers:
+                server.close()
+            self._ready.set()
+            return
+        self._ready.set()
+
+        broadcaster = asyncio.ensure_future(self._broadcast())
+        await self._stopping.wait()
+
+        # Shut down: stop accepting, tell every client handler to finish
+        broadcaster.cancel()
+        for server in servers:
+            server.close()
+        clients = list(self.clients)
+        for client in clients:
+            client.close()
+        # clients stuck on a full socket buffer are cut off after a short grace period
+        if clients:
+            _, stuck = await asyncio.wait([client.task for client in clients], timeout=1.0)
+            for task in stuck:
+                task.cancel()
+            if stuck:
+                await asyncio.wait(stuck)
+        for server in servers:
+            await server.wait_closed()
+
+    # Encode the pending frame once and offer the encoded bytes to every client
+    async def _broadcast(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is None:
+                continue
+            metrics, preview = pending
+            self.latest_metrics = metrics
+
+            payload = json.dumps(metrics, default=json_default).encode("utf-8")
+            encoded = {
+                "ws": websocket_frame(payload),
+                "binary": struct.pack(">I", len(payload)) + payload,
+                "mjpeg": None,
+            }
+            if preview is not None:
+                # JPEG encoding runs in the default executor so client writes keep flowing
+                encoded["mjpeg"] = await self.loop.run_in_executor(
+                    None, mjpeg_part, preview, self.jpeg_quality
+                )
+
+            for client in list(self.clients):
+                message = encoded[client.kind]
+                if message is not None:
+                    client.offer(message)
+            self.broadcast += 1
+
+    # Drain a client's queue into its socket until it disconnects or the server stops.
+    # WebSocket clients are read at the same time so Close and Ping frames get answered
+    async def _stream(self, reader, writer, kind):
+        client = StreamClient(writer, kind, self.queue_size)
+        self.clients.add(client)
+        control = None
+        if kind == "ws":
+            control = asyncio.ensure_future(self._read_websocket(reader, client))
+        try:
+            while True:
+                message = await client.queue.get()
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+                client.sent += 1
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass
+        finally:
+            if control is not None:
+                control.cancel()
+            self.clients.discard(client)
+            writer.close()
+
+    # Read client frames (RFC 6455): answer Ping with Pong and Close with Close, then end
+    # the stream. Data frames from the client are ignored; a disconnect also ends the stream
+    async def _read_websocket(self, reader, client):
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                opcode = head[0] & 0x0F
+                length = head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", await reader.readexactly(8))[0]
+                if length > WS_MAX_CLIENT_FRAME:
+                    client.writer.write(websocket_frame(struct.pack(">H", 1009), 0x8))
+                    break
+                mask = await reader.readexactly(4) if head[1] & 0x80 else bytes(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+                if opcode == 0x8:
+                    # echo the status code, if any, and stop sending data frames
+                    client.writer.write(websocket_frame(payload[:2], 0x8))
+                    break
+                elif opcode == 0x9:
+                    client.writer.write(websocket_frame(payload, 0xA))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        client.close(discard=True)
+
+    # Minimal HTTP request handling for the WebSocket, MJPEG and latest-metrics endpoints
+    async def _handle_http(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            writer.close()
+            return
+        path = path.split("?", 1)[0]
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        if method != "GET":
+            self._respond(writer, "405 Method Not Allowed", "text/plain", b"Method not allowed")
+        elif path == "/metrics" and headers.get("upgrade", "").lower() == "websocket":
+            key = headers.get("sec-websocket-key", "")
+            accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest())
+            writer.write(
+                b"HTTP/1.1 101 Switching Protocols\r\n"
+                b"Upgrade: websocket\r\n"
+                b"Connection: Upgrade\r\n"
+                b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+            )
+            await self._stream(reader, writer, "ws")
+            return
+        elif path == "/stream.mjpg":
+            writer.write(
+                (
+                    "HTTP/1.1 200 OK\r\n"
+                    "Content-Type: multipart/x-mixed-replace; boundary=" + MJPEG_BOUNDARY + "\r\n"
+                    "Cache-Control: no-cache\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("ascii")
+            )
+            await self._stream(reader, writer, "mjpeg")
+            return
+        elif path == "/latest":
+            body = json.dumps(self.latest_metrics, default=json_default).encode("utf-8")
+            self._respond(writer, "200 OK", "application/json", body)
+        else:
+            self._respond(writer, "404 Not Found", "text/plain", b"Not found")
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    # Length-prefixed binary metrics stream: no handshake, streaming starts on connect
+    async def _handle_binary(self, reader, writer):
+        await self._stream(reader, writer, "binary")
+
+    @staticmethod
+    def _respond(writer, status, content_type, body):
+        writer.write(
+            (
+                "HTTP/1.1 " + status + "\r\n"
+                "Content-Type: " + content_type + "\r\n"
+                "Content-Length: " + str(len(body)) + "\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("ascii")
+            + body
+        )
@@ -0,0 +1,454 @@
+# Vyir
+# Vyirtech.com
+
+# Writing saved data: camera/beam frames with a selectable codec, profiles and
+# statistics as a single .npz (or vectorized CSV), and optional profile plots
+# rendered off-screen. Saves are grouped in sessions with monotonic frame sequence
+# numbers and recorded in an append-only SQLite index, so frames can be looked up
+# by time range or metric thresholds without listing directories.
+# Run `python BeamStorage.py benchmark` to benchmark save size and latency, and
+# `python BeamStorage.py query` to search the index.
+
+# required imports
+import os
+import time
+import datetime
+import json
+import sqlite3
+import threading
+
+import numpy as np
+import cv2
+
+# frame codecs: default PNG, smaller but slower PNG, raw NumPy array, lossless 16-bit TIFF,
+# and raw bytes appended to one container file per session (located through the index offsets)
+FRAME_CODECS = ("png", "png-small", "npy", "tiff16", "raw")
+# zlib level of "png-small": smaller files than "png" but several times slower to write
+PNG_SMALL_LEVEL = 6
+# formats for profiles and statistics
+DATA_FORMATS = ("npz", "csv")
+
+
+# Write one frame with the given codec. Returns the path of the written file
+def write_frame(path_base, image, codec="png"):
+    if codec == "png":
+        # OpenCV's defaults are already its fastest compressed PNG settings
+        path = path_base + ".png"
+        cv2.imwrite(path, image)
+    elif codec == "png-small":
+        path = path_base + ".png"
+        cv2.imwrite(path, image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_SMALL_LEVEL])
+    elif codec == "npy":
+        path = path_base + ".npy"
+        np.save(path, image)
+    elif codec == "tiff16":
+        # 8-bit values scaled by 257 so 255 maps to 65535; divide by 257 to recover them
+        path = path_base + ".tiff"
+        cv2.imwrite(path, image.astype(np.uint16) * 257)
+    elif codec == "raw":
+        raise ValueError("The raw codec appends to a session container, use SaveSession.write_frame")
+    else:
+        raise ValueError("Unknown frame codec: " + str(codec))
+    return path
+
+
+# Whole-frame statistics, computed from the 256-bin histogram when one is available
+def frame_stats(image, dark_pixel_threshold=0, histogram=None):
+    if histogram is None:
+        histogram = cv2.calcHist([image], [0], None, [256], [0, 256]).ravel()
+    lit = np.flatnonzero(histogram)
+    total = float(np.dot(histogram, np.arange(256)))
+    return {
+        "dark_pixel_threshold": dark_pixel_threshold,
+        "dark_pixels": int(histogram[: dark_pixel_threshold + 1].sum()),
+        "max_pixel": int(lit[-1]) if len(lit) else 0,
+        "min_pixel": int(lit[0]) if len(lit) else 0,
+        "total_pixel_counts": int(total),
+        "average_pixel_count": total / image.size,
+    }
+
+
+# Write profiles and statistics. "npz" writes a single uncompressed NumPy archive;
+# "csv" writes stats and profiles with np.savetxt. Returns the written paths
+def write_data(path_base, stats, x_prof, y_prof, data_format="npz"):
+    if data_format == "npz":
+        path = path_base + ".npz"
+        np.savez(path, x_profile=x_prof, y_profile=y_prof, **{k: np.asarray(v) for k, v in stats.items()})
+        return [path]
+    elif data_format == "csv":
+        stats_path = path_base + "_stats.csv"
+        names = list(stats.keys())
+        np.savetxt(
+            stats_path,
+            np.array([[float(stats[k]) for k in names]]),
+            delimiter=",",
+            header=",".join(names),
+            comments="",
+            fmt="%.10g",
+        )
+        # profiles in columns (pixel #, x, y); the shorter profile is padded with NaN
+        n = max(len(x_prof), len(y_prof))
+        table = np.full((n, 3), np.nan)
+        table[:, 0] = np.arange(n)
+        table[: len(x_prof), 1] = x_prof
+        table[: len(y_prof), 2] = y_prof
+        profiles_path = path_base + "_profiles.csv"
+        np.savetxt(
+            profiles_path,
+            table,
+            delimiter=",",
+            header="Pixel #,X-axis Intensity Value,Y-axis Intensity Value",
+            comments="",
+            fmt="%g",
+        )
+        return [stats_path, profiles_path]
+    raise ValueError("Unknown data format: " + str(data_format))
+
+
+# Profile plots rendered with one reused off-screen Agg figure (no pyplot global state)
+class ProfilePlotter:
+    def __init__(self):
+        # imported here so saving without plots never loads matplotlib
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.figure = Figure()
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(111)
+
+    def plot(self, path, data, title):
+        ax = self.ax
+        ax.clear()
+        ax.plot(range(len(data)), data)
+        ax.set_title(title)
+        ax.set_xlim(0, len(data) - 1)
+        ax.set_ylim(0, 255)
+        ax.set_xlabel("Pixel")
+        ax.set_ylabel("Intensity")
+        self.figure.savefig(path)
+        return path
+
+
+# file name of the index kept in the save root
+INDEX_NAME = "beam_index.sqlite"
+# metrics stored in their own columns so they can be used in queries
+INDEX_METRICS = (
+    "centroid_x",
+    "centroid_y",
+    "d4x",
+    "d4y",
+    "peak",
+    "saturated_pixels",
+    "fit_x_sigma",
+    "fit_y_sigma",
+    "fit_x_fwhm",
+    "fit_y_fwhm",
+)
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    camera TEXT,
+    started_us INTEGER NOT NULL,
+    ended_us INTEGER,
+    frames INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS frames (
+    session_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp_us INTEGER NOT NULL,
+    """ + "".join(name + " REAL,\n    " for name in INDEX_METRICS) + """metrics TEXT,
+    notes TEXT,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE INDEX IF NOT EXISTS frames_time ON frames (timestamp_us);
+CREATE TABLE IF NOT EXISTS files (
+    session_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL,
+    shape TEXT,
+    dtype TEXT
+);
+CREATE INDEX IF NOT EXISTS files_frame ON files (session_id, seq);
+"""
+
+
+# Microseconds since the epoch from a datetime, an ISO date string or a number
+def to_us(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp() * 1000000)
+    return int(value)
+
+
+# Append-only SQLite index of sessions, frames (with metrics) and saved files.
+# Rows are committed in batches so logging does not wait on a disk sync every frame
+class BeamIndex:
+    def __init__(self, root, commit_every=1.0):
+        self.root = root
+        self.path = os.path.join(root, INDEX_NAME)
+        self.commit_every = commit_every  # seconds between commits while logging
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(INDEX_SCHEMA)
+        self.db.commit()
+        self._lock = threading.Lock()
+        self._last_commit = time.monotonic()
+
+    def add_session(self, name, path, started_us, camera=""):
+        with self._lock:
+            cursor = self.db.execute(
+                "INSERT INTO sessions (name, path, camera, started_us) VALUES (?, ?, ?, ?)",
+                (name, os.path.relpath(path, self.root), camera, started_us),
+            )
+            self.db.commit()
+            return cursor.lastrowid
+
+    # Record one saved frame: its metrics and the (path, offset, nbytes, shape, dtype) of each file
+    def add_frame(self, session_id, seq, timestamp_us, metrics, files, notes=""):
+        row = [session_id, seq, timestamp_us]
+        row += [metrics.get(name) for name in INDEX_METRICS]
+        row += [json.dumps(metrics, default=float), notes]
+        with self._lock:
+            self.db.execute(
+                "INSERT INTO frames VALUES (" + ",".join("?" * len(row)) + ")", row
+            )
+            self.db.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, seq, kind, os.path.relpath(path, self.root), offset, nbytes, shape, dtype)
+                    for kind, path, offset, nbytes, shape, dtype in files
+                ],
+            )
+            self.db.execute(
+                "UPDATE sessions SET frames = frames + 1, ended_us = ? WHERE id = ?",
+                (timestamp_us, session_id),
+            )
+
+    # Commit pending rows (at most every commit_every seconds unless forced)
+    def commit(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_commit >= self.commit_every:
+            with self._lock:
+                self.db.commit()
+            self._last_commit = now
+
+    # Frames within a time range (datetimes, ISO strings or microseconds) whose metrics
+    # satisfy limits given as <metric>_min / <metric>_max, e.g. d4x_max=500
+    def query(self, start=None, end=None, session_id=None, limit=None, **limits):
+        where, args = [], []
+        if start is not None:
+            where.append("timestamp_us >= ?")
+            args.append(to_us(start))
+        if end is not None:
+            where.append("timestamp_us <= ?")
+            args.append(to_us(end))
+        if session_id is not None:
+            where.append("session_id = ?")
+            args.append(session_id)
+        for key, value in limits.items():
+            name, _, bound = key.rpartition("_")
+            if name not in INDEX_METRICS or bound not in ("min", "max"):
+                raise ValueError("Unknown query limit: " + key)
+            where.append(name + (" >= ?" if bound == "min" else " <= ?"))
+            args.append(value)
+        sql = "SELECT * FROM frames"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp_us"
+        if limit is not None:
+            sql += " LIMIT " + str(int(limit))
+
+        with self._lock:
+            cursor = self.db.execute(sql, args)
+            names = [column[0] for column in cursor.description]
+            rows = [dict(zip(names, values)) for values in cursor.fetchall()]
+            for row in rows:
+                row["metrics"] = json.loads(row["metrics"])
+                row["files"] = [
+                    dict(zip(("kind", "path", "offset", "nbytes", "shape", "dtype"), values))
+                    for values in self.db.execute(
+                        "SELECT kind, path, offset, nbytes, shape, dtype FROM files "
+                        "WHERE session_id = ? AND seq = ?",
+                        (row["session_id"], row["seq"]),
+                    )
+                ]
+        return rows
+
+    def sessions(self):
+        with self._lock:
+            cursor = self.db.execute("SELECT * FROM sessions ORDER BY started_us")
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, values)) for values in cursor.fetchall()]
+
+    def close(self):
+        self.commit(force=True)
+        self.db.close()
+
+
+# Load a saved frame from a file entry returned by BeamIndex.query()
+def read_frame(root, entry):
+    path = os.path.join(root, entry["path"])
+    if entry["dtype"] is not None:
+        # raw container: read nbytes at the recorded offset
+        shape = tuple(int(n) for n in entry["shape"].split("x"))
+        with open(path, "rb") as f:
+            f.seek(entry["offset"])
+            data = np.fromfile(f, dtype=entry["dtype"], count=int(np.prod(shape)))
+        return data.reshape(shape)
+    if path.endswith(".npy"):
+        return np.load(path)
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is not None and image.dtype == np.uint16:
+        image = (image // 257).astype(np.uint8)
+    return image
+
+
+# One recording session: a collision-free directory (microsecond timestamp, numbered
+# suffix if it still exists), monotonic frame sequence numbers and index entries.
+# Sessions writing concurrently to the same root should share one BeamIndex (`index`),
+# otherwise their batched transactions wait on each other
+class SaveSession:
+    def __init__(self, root=None, camera="", index=None):
+        self.root = root or os.getcwd()
+        started = datetime.datetime.now()
+        self.name = "session_" + started.strftime("%Y%m%d_%H%M%S_%f")
+        path = os.path.join(self.root, self.name)
+        n = 1
+        while True:
+            try:
+                os.makedirs(path)
+                break
+            except FileExistsError:
+                path = os.path.join(self.root, self.name + "_" + str(n))
+                n += 1
+        self.path = path
+        self.owns_index = index is None
+        self.index = BeamIndex(self.root) if index is None else index
+        self.id = self.index.add_session(self.name, path, to_us(started), camera)
+        self.seq = 0  # sequence number of the latest frame
+        self._containers = {}  # open raw container file per frame kind
+
+    # Reserve the next sequence number and a microsecond timestamp
+    def next_frame(self):
+        self.seq += 1
+        return self.seq, time.time_ns() // 1000
+
+    # Path (without extension) for a file of the given kind belonging to frame `seq`
+    def path_base(self, prefix, kind, seq):
+        return os.path.join(self.path, prefix + kind + "_" + "{:08d}".format(seq))
+
+    # Write a frame; returns the index file entry (kind, path, offset, nbytes, shape, dtype)
+    def write_frame(self, prefix, kind, seq, image, codec):
+        if codec == "raw":
+            container = self._containers.get(kind)
+            if container is None:
+                container = open(os.path.join(self.path, prefix + kind + ".raw"), "ab")
+                self._containers[kind] = container
+            offset = container.tell()
+            container.write(image.tobytes())
+            shape = "x".join(str(n) for n in image.shape)
+            return (kind, container.name, offset, image.nbytes, shape, str(image.dtype))
+        path = write_frame(self.path_base(prefix, kind, seq), image, codec)
+        return (kind, path, 0, os.path.getsize(path), None, None)
+
+    # Entry for a file that is not a frame (data, notes, plots)
+    def file_entry(self, kind, path):
+        return (kind, path, 0, os.path.getsize(path), None, None)
+
+    def record(self, seq, timestamp_us, metrics, files, notes="", commit=False):
+        for container in self._containers.values():
+            container.flush()
+        self.index.add_frame(self.id, seq, timestamp_us, metrics, files, notes)
+        self.index.commit(force=commit)
+
+    def close(self):
+        for container in self._containers.values():
+            container.close()
+        self._containers.clear()
+        if self.owns_index:
+            self.index.close()
+        else:
+            self.index.commit(force=True)
+
+
+# Save one simulated frame per resolution and codec; returns rows of
+# (resolution, codec, bytes per save, save latency in ms)
+def benchmark_save(savepath, repeats=3, data_format="npz", plots=False):
+    from BeamCore import RESOLUTIONS, BeamProcessor, CameraSettings, SimulatedCameraSource
+
+    rows = []
+    for resolution in RESOLUTIONS:
+        source = SimulatedCameraSource(CameraSettings(resolution=resolution), rate=0.2)
+        source.open()
+        processor = BeamProcessor()
+        processor.save_root = savepath
+        processor.analyze(source.capture())
+        processor.fit_profiles()
+        processor.data_format = data_format
+        processor.save_plots = plots
+        for codec in FRAME_CODECS:
+            processor.frame_codec = codec
+            results = [processor.save() for _ in range(repeats)]
+            rows.append(
+                (
+                    resolution,
+                    codec,
+                    results[-1]["bytes"],
+                    min(result["ms"] for result in results),
+                )
+            )
+        processor.close_session()
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Saved data tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("benchmark", help="bytes per save and save latency per resolution and codec")
+    bench.add_argument("--data-format", choices=DATA_FORMATS, default="npz")
+    bench.add_argument("--plots", action="store_true", help="include the profile plots")
+    bench.add_argument("--repeats", type=int, default=3)
+
+    query = commands.add_parser("query", help="find saved frames by time range and metric limits")
+    query.add_argument("--root", default=os.getcwd(), help="save root containing " + INDEX_NAME)
+    query.add_argument("--start", help="ISO date/time, e.g. 2026-10-19T10:00")
+    query.add_argument("--end", help="ISO date/time")
+    query.add_argument("--limit", type=int, default=None)
+    for name in INDEX_METRICS:
+        query.add_argument("--" + name + "-min", type=float, dest=name + "_min")
+        query.add_argument("--" + name + "-max", type=float, dest=name + "_max")
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        with tempfile.TemporaryDirectory() as tmp:
+            rows = benchmark_save(tmp, args.repeats, args.data_format, args.plots)
+        print("{:>12}{:>10}{:>14}{:>10}".format("resolution", "codec", "bytes/save", "ms"))
+        for (W, H), codec, nbytes, ms in rows:
+            print("{:>12}{:>10}{:>14}{:>10.1f}".format(str(W) + "x" + str(H), codec, nbytes, ms))
+    else:
+        limits = {
+            key: value
+            for key, value in vars(args).items()
+            if key.endswith(("_min", "_max")) and value is not None
+        }
+        index = BeamIndex(args.root)
+        for row in index.query(args.start, args.end, limit=args.limit, **limits):
+            timestamp = datetime.datetime.fromtimestamp(row["timestamp_us"] / 1000000)
+            print(
+                "session " + str(row["session_id"]) + " frame " + str(row["seq"])
+                + " " + timestamp.isoformat()
+                + " d4x={:.1f} d4y={:.1f} ".format(row["d4x"] or 0, row["d4y"] or 0)
+                + " ".join(entry["path"] for entry in row["files"])
+            )
+        index.close()
@@ -0,0 +1,8 @@
+# Vyir
+# Vyirtech.com
+
+# The beam profiler modules live in the repository root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
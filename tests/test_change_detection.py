@@ -0,0 +1,89 @@
+# Vyir
+# Vyirtech.com
+
+# Skipping unchanged frames: which frames are reused, the forced refresh and the
+# same_as rows logged for reused frames
+
+# required imports
+import collections
+import time
+
+from BeamCore import BeamProcessor, CameraSettings, FrameChangeDetector, SimulatedCameraSource
+from BeamMulti import MultiCameraRunner
+from BeamStorage import BeamIndex
+
+
+def noise_free_source():
+    source = SimulatedCameraSource(CameraSettings(), noise=0)
+    source.open()
+    return source
+
+
+def log_frames(root, frames, refresh_every, change_at=None):
+    processor = BeamProcessor()
+    processor.save_root = root
+    processor.change_detector = FrameChangeDetector(1.0, refresh_every=refresh_every)
+    source = noise_free_source()
+    processor.set_logging(True)
+    reused = []
+    for n in range(1, frames + 1):
+        if n == change_at:
+            source.reconfigure(source.settings.copy().update(shutter_speed=2 * source.settings.shutter_speed))
+        reused.append(processor.process(source.capture(), fit=False)["reused"])
+    processor.set_logging(False)
+    processor.close_session()
+    return processor, reused
+
+
+def test_unchanged_frames_are_reused_until_the_refresh(tmp_path):
+    processor, reused = log_frames(str(tmp_path), 12, refresh_every=5)
+    # frame 1 is analysed, 2-6 are reused, frame 7 is the forced refresh
+    assert reused == [False] + [True] * 5 + [False] + [True] * 5
+    assert processor.change_detector.unchanged == 10
+    assert processor.change_detector.skipped["analyze"] == 10
+
+
+def test_a_changed_frame_is_analysed(tmp_path):
+    _, reused = log_frames(str(tmp_path), 6, refresh_every=30, change_at=4)
+    assert reused == [False, True, True, False, True, True]
+
+
+def test_reused_frames_point_at_a_saved_frame(tmp_path):
+    log_frames(str(tmp_path), 12, refresh_every=5)
+    index = BeamIndex(str(tmp_path))
+    rows = {row["seq"]: row for row in index.query()}
+    index.close()
+
+    assert sorted(rows) == list(range(1, 13))
+    assert [seq for seq, row in rows.items() if row["files"]] == [1, 7]
+    for seq, row in rows.items():
+        if row["files"]:
+            assert "same_as" not in row["metrics"]
+        else:
+            assert row["metrics"]["same_as"] == (1 if seq < 7 else 7)
+            assert rows[row["metrics"]["same_as"]]["files"]
+
+
+def test_multi_camera_logging_skips_unchanged_frames(tmp_path):
+    runner = MultiCameraRunner(workers=2, fit=False, save_root=str(tmp_path), change_threshold=1.0, refresh_every=10)
+    runner.add_source("a", SimulatedCameraSource(CameraSettings(), noise=0))
+    runner.add_source("b", SimulatedCameraSource(CameraSettings(), noise=0, seed=1))
+    runner.start()
+    runner.set_logging(True)
+    time.sleep(1.0)
+    runner.set_logging(False)
+    runner.stop()
+
+    index = BeamIndex(str(tmp_path))
+    rows = index.query()
+    index.close()
+    by_session = collections.defaultdict(dict)
+    for row in rows:
+        by_session[row["session_id"]][row["seq"]] = row
+    assert len(by_session) == 2
+    for session_rows in by_session.values():
+        saved = [seq for seq, row in session_rows.items() if row["files"]]
+        unchanged = [row for row in session_rows.values() if not row["files"]]
+        assert unchanged and len(saved) < len(unchanged)
+        for row in unchanged:
+            assert session_rows[row["metrics"]["same_as"]]["files"]
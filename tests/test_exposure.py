@@ -0,0 +1,36 @@
+# Vyir
+# Vyirtech.com
+
+# Auto-exposure convergence on the simulated camera
+
+# required imports
+import numpy as np
+import pytest
+
+from BeamExposure import FULL_SCALE, ExposureController, simulate_convergence
+
+# frames the controller may take to settle from any start, including saturated starts
+MAX_SETTLING_FRAMES = 30
+
+
+@pytest.mark.parametrize("rate", [0.05, 0.2, 1.0])
+@pytest.mark.parametrize("shutter", [10, 100, 1000, 10000, 100000])
+def test_settles_below_saturation(rate, shutter):
+    frames, final_shutter, peak = simulate_convergence(shutter, rate=rate)
+    assert frames is not None and frames <= MAX_SETTLING_FRAMES
+    assert peak < FULL_SCALE
+    assert abs(peak - 0.8 * FULL_SCALE) <= 0.05 * FULL_SCALE
+
+
+@pytest.mark.parametrize("target_fill", [0.5, 0.9])
+def test_follows_target_fill(target_fill):
+    frames, _, peak = simulate_convergence(1000, target_fill=target_fill)
+    assert frames is not None and frames <= MAX_SETTLING_FRAMES
+    assert abs(peak - target_fill * FULL_SCALE) <= 0.05 * FULL_SCALE
+
+
+def test_saturation_backs_off_by_max_step():
+    controller = ExposureController(holdoff=0)
+    histogram = np.zeros(256)
+    histogram[FULL_SCALE] = 1000
+    assert controller.update(histogram, 4000) == 1000
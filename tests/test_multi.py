@@ -0,0 +1,46 @@
+# Vyir
+# Vyirtech.com
+
+# Multi-camera logging: every logged frame is saved exactly once, through the save writer
+
+# required imports
+import collections
+import time
+
+from BeamMulti import MultiCameraRunner
+from BeamStorage import BeamIndex
+
+
+def test_logged_frames_map_one_to_one_to_sequence_numbers(tmp_path):
+    runner = MultiCameraRunner(workers=2, fit=False, save_root=str(tmp_path))
+    runner.add_source("a", "sim")
+    runner.add_source("b", "sim:1")
+    runner.start()
+    runner.set_logging(True)
+    time.sleep(1.0)
+    runner.set_logging(False)
+    # stopping writes the saves still queued
+    runner.stop()
+    stats = runner.stats()
+
+    index = BeamIndex(str(tmp_path))
+    rows = index.query()
+    sessions = {session["id"]: session["camera"] for session in index.sessions()}
+    index.close()
+
+    by_session = collections.defaultdict(list)
+    for row in rows:
+        by_session[row["session_id"]].append(row)
+    assert sorted(sessions.values()) == ["a", "b"]
+    for session_id, session_rows in by_session.items():
+        session_rows.sort(key=lambda row: row["seq"])
+        seqs = [row["seq"] for row in session_rows]
+        frames = [row["metrics"]["frame"] for row in session_rows]
+        # sequence numbers are contiguous and each frame is saved under exactly one of them
+        assert seqs == list(range(1, len(seqs) + 1))
+        assert len(set(frames)) == len(frames)
+        assert frames == sorted(frames)
+        assert len(session_rows) == stats["cameras"][sessions[session_id]]["saved"]
+        # logging waits for the save writer instead of dropping frames
+        assert stats["cameras"][sessions[session_id]]["save_dropped"] == 0
+        assert len(session_rows) > 1
@@ -0,0 +1,176 @@
+# Vyir
+# Vyirtech.com
+
+# BeamStreamServer against localhost clients: WebSocket, binary and MJPEG streams,
+# WebSocket Close/Ping handling and dropping messages for a client which does not read
+
+# required imports
+import base64
+import json
+import os
+import socket
+import struct
+import time
+
+import numpy as np
+import pytest
+
+from BeamServer import BeamStreamServer
+
+
+@pytest.fixture
+def server():
+    server = BeamStreamServer(port=0, binary_port=0, preview_every=1, queue_size=2).start()
+    yield server
+    server.stop()
+
+
+def connect(port):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    return sock
+
+
+def read_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("closed after " + str(len(data)) + " bytes")
+        data += chunk
+    return data
+
+
+def read_until(sock, marker):
+    data = b""
+    while marker not in data:
+        chunk = sock.recv(1)
+        if not chunk:
+            raise ConnectionError("closed")
+        data += chunk
+    return data
+
+
+def websocket_connect(port):
+    sock = connect(port)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    sock.sendall(
+        (
+            "GET /metrics HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            "Sec-WebSocket-Key: " + key + "\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode("ascii")
+    )
+    assert read_until(sock, b"\r\n\r\n").startswith(b"HTTP/1.1 101")
+    return sock
+
+
+# Read one server frame: (opcode, payload)
+def websocket_read(sock):
+    head = read_exactly(sock, 2)
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", read_exactly(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", read_exactly(sock, 8))[0]
+    return head[0] & 0x0F, read_exactly(sock, length)
+
+
+# Send one masked client frame
+def websocket_send(sock, opcode, payload=b""):
+    mask = os.urandom(4)
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    sock.sendall(bytes([0x80 | opcode, 0x80 | len(payload)]) + mask + masked)
+
+
+# Publish until every client socket has data waiting (clients connect asynchronously)
+def publish_until_readable(server, sockets, metrics, frame=None, timeout=5.0):
+    import select
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        server.publish(metrics, frame)
+        readable, _, _ = select.select(sockets, [], [], 0.05)
+        if len(readable) == len(sockets):
+            return
+    raise AssertionError("clients received nothing")
+
+
+def test_websocket_binary_and_mjpeg_clients(server):
+    ws = websocket_connect(server.port)
+    binary = connect(server.binary_port)
+    mjpeg = connect(server.port)
+    mjpeg.sendall(b"GET /stream.mjpg HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    assert b"multipart/x-mixed-replace" in read_until(mjpeg, b"\r\n\r\n")
+
+    frame = np.zeros((480, 640, 3), np.uint8)
+    publish_until_readable(server, [ws, binary, mjpeg], {"frame": 1, "d4x": 12.5}, frame)
+
+    opcode, payload = websocket_read(ws)
+    assert opcode == 0x1
+    assert json.loads(payload)["d4x"] == 12.5
+
+    length = struct.unpack(">I", read_exactly(binary, 4))[0]
+    assert json.loads(read_exactly(binary, length))["frame"] == 1
+
+    headers = read_until(mjpeg, b"\r\n\r\n").decode("ascii")
+    assert headers.startswith("--beamframe")
+    length = int(headers.split("Content-Length: ")[1].split("\r\n")[0])
+    jpeg = read_exactly(mjpeg, length)
+    assert jpeg[:2] == b"\xff\xd8" and jpeg[-2:] == b"\xff\xd9"
+
+    for sock in (ws, binary, mjpeg):
+        sock.close()
+
+
+def test_websocket_ping_and_close(server):
+    ws = websocket_connect(server.port)
+    websocket_send(ws, 0x9, b"hello")
+    # data frames may arrive before the pong
+    opcode, payload = websocket_read(ws)
+    while opcode == 0x1:
+        opcode, payload = websocket_read(ws)
+    assert (opcode, payload) == (0xA, b"hello")
+
+    websocket_send(ws, 0x8, struct.pack(">H", 1000))
+    opcode, payload = websocket_read(ws)
+    while opcode == 0x1:
+        opcode, payload = websocket_read(ws)
+    assert (opcode, payload) == (0x8, struct.pack(">H", 1000))
+    # the server closes the connection after the Close frame
+    assert ws.recv(1) == b""
+
+    deadline = time.time() + 5
+    while server.stats()["clients"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert server.stats()["clients"] == []
+    ws.close()
+
+
+def test_slow_client_drops_messages(server):
+    slow = connect(server.binary_port)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    fast = connect(server.binary_port)
+    publish_until_readable(server, [fast], {"frame": 0})
+
+    # large payloads fill the socket buffers of the client which never reads
+    padding = "x" * 200000
+    deadline = time.time() + 20
+    n = 0
+    while time.time() < deadline:
+        n += 1
+        server.publish({"frame": n, "padding": padding})
+        time.sleep(0.002)
+        dropped = [client["dropped"] for client in server.stats()["clients"]]
+        if any(dropped):
+            break
+    assert any(client["dropped"] > 0 for client in server.stats()["clients"])
+
+    # the publisher was never blocked and the reading client still gets recent frames
+    fast.settimeout(5)
+    last = None
+    while True:
+        length = struct.unpack(">I", read_exactly(fast, 4))[0]
+        last = json.loads(read_exactly(fast, length))["frame"]
+        if last >= n - 5:
+            break
+    slow.close()
+    fast.close()
@@ -0,0 +1,77 @@
+# Vyir
+# Vyirtech.com
+
+# Live camera settings through the control endpoint: unsupported resolutions are refused
+# and settings rejected by the camera leave the capture loop running on the previous ones
+
+# required imports
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from BeamCore import CameraSettings, SimulatedCameraSource
+from BeamHeadless import BeamDaemon, ControlServer
+
+
+# Simulated camera which rejects shutter speeds above 50000 μs, like PiCamera rejects
+# values outside the sensor's range
+class PickyCameraSource(SimulatedCameraSource):
+    def reconfigure(self, settings):
+        if settings.shutter_speed > 50000:
+            raise ValueError("Invalid shutter speed")
+        return SimulatedCameraSource.reconfigure(self, settings)
+
+
+@pytest.fixture
+def control():
+    daemon = BeamDaemon(CameraSettings(), source_factory=PickyCameraSource, fit=False)
+    control = ControlServer(daemon, port=0).start()
+    daemon.start()
+    yield daemon, "http://127.0.0.1:" + str(control.server_address[1])
+    daemon.stop()
+    control.stop()
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=15) as reply:
+            return reply.status, json.loads(reply.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_unsupported_resolution_is_refused():
+    with pytest.raises(ValueError):
+        CameraSettings(resolution="0x0")
+    assert CameraSettings(resolution="1920x1080").resolution == (1920, 1080)
+
+
+def test_settings_are_applied_live(control):
+    daemon, url = control
+    code, reply = request(url + "/settings", {"shutter_speed": 2000, "resolution": "1280x720"})
+    assert code == 200
+    assert daemon.source.settings.shutter_speed == 2000
+    assert daemon.source.settings.resolution == (1280, 720)
+
+
+def test_rejected_settings_keep_the_loop_running(control):
+    daemon, url = control
+    code, reply = request(url + "/settings", {"resolution": "0x0"})
+    assert code == 400
+    assert daemon.settings.resolution == (640, 480)
+
+    code, reply = request(url + "/settings", {"shutter_speed": 100000})
+    assert code == 400
+    assert "Invalid shutter speed" in reply["error"]
+    frames = daemon.processor.frame_count
+    time.sleep(0.2)
+    code, status = request(url + "/status")
+    assert status["running"] and status["error"] is None
+    assert status["frames"] > frames
+    assert status["settings"]["shutter_speed"] == 1000
+    assert "Invalid shutter speed" in status["settings_error"]
+    assert daemon.source.settings.shutter_speed == 1000
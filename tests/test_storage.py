@@ -0,0 +1,71 @@
+# Vyir
+# Vyirtech.com
+
+# Save sessions and the frame index: sessions started in the same second get their own
+# directories, sequence numbers are contiguous and saved frames are found again
+
+# required imports
+import datetime
+
+import numpy as np
+
+import BeamStorage
+from BeamStorage import BeamIndex, SaveSession, read_frame
+
+
+# datetime whose now() is always the same instant, so both sessions get the same name
+class FrozenDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2026, 10, 19, 12, 0, 0, 123456)
+
+
+def record_frames(session, count, d4x_start):
+    images = []
+    for n in range(count):
+        seq, timestamp_us = session.next_frame()
+        image = np.full((48, 64, 3), seq, np.uint8)
+        files = [session.write_frame("", "camera", seq, image, "raw")]
+        session.record(seq, timestamp_us, {"frame": seq, "d4x": d4x_start + 10.0 * n}, files)
+        images.append(image)
+    return images
+
+
+def test_sessions_in_the_same_second_do_not_collide(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    index = BeamIndex(root)
+    monkeypatch.setattr(BeamStorage.datetime, "datetime", FrozenDatetime)
+    first = SaveSession(root, "a", index)
+    second = SaveSession(root, "b", index)
+    monkeypatch.undo()
+
+    assert first.name == second.name
+    assert first.path != second.path
+    assert second.path.endswith("_1")
+    assert first.id != second.id
+
+    started = datetime.datetime.now()
+    first_images = record_frames(first, 3, 100.0)
+    second_images = record_frames(second, 4, 200.0)
+    first.close()
+    second.close()
+
+    rows = index.query()
+    for session, count in ((first, 3), (second, 4)):
+        seqs = sorted(row["seq"] for row in rows if row["session_id"] == session.id)
+        assert seqs == list(range(1, count + 1))
+
+    # by time range: everything recorded after `started`, nothing from before
+    assert len(index.query(start=started)) == 7
+    assert index.query(end=started - datetime.timedelta(seconds=1)) == []
+    # by metric limits: d4x 100, 110, 120 in the first session, 200-230 in the second
+    limited = index.query(start=started, d4x_max=115)
+    assert [(row["session_id"], row["seq"]) for row in limited] == [(first.id, 1), (first.id, 2)]
+
+    # raw frames are read back from the session containers at the indexed offsets
+    for row in rows:
+        images = first_images if row["session_id"] == first.id else second_images
+        (entry,) = row["files"]
+        assert entry["dtype"] == "uint8"
+        np.testing.assert_array_equal(read_frame(root, entry), images[row["seq"] - 1])
+    index.close()